@@ -2,17 +2,85 @@
 """
 coingecko_client.py
 Coleta preços e OHLC do Coingecko com backoff e limites.
+
+Transporte: HTTP/1.1 keep-alive via requests.Session com pool (pool_maxsize=32).
+As chamadas simultâneas do ciclo (OHLC_CONCURRENCY no main.py) usam conexões
+distintas do mesmo pool, sem handshake TLS a cada request; não há ganho
+relevante em HTTP/2 para esse volume e evitamos trocar de stack (httpx/h2).
+
+fetch_ohlc_many: alternativa opcional com aiohttp (vários /ohlc em voo numa
+só thread, com um event loop e uma ClientSession próprios em background).
 """
 
+import os
 import time
+import atexit
+import asyncio
+import logging
 import math
+import random
+import threading
+import orjson
 import requests
-from typing import Dict, List, Tuple
+from collections import deque
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from types import MappingProxyType
+from typing import Any, Deque, Dict, List, Mapping, Tuple
+
+log = logging.getLogger("coingecko")
 
 BASE = "https://api.coingecko.com/api/v3"
 
+# /simple/price aceita centenas de ids; com a lista do config.py (~25) tudo sai
+# num único GET por ciclo. Só acima disso dividimos em lotes.
+PRICE_BATCH_SIZE = 100
+
+# Preços mudam rápido, mas chamadas repetidas dentro de 1 min (test-ai,
+# resolver, force-update) podem reaproveitar a resposta anterior.
+PRICE_TTL_SEC = 60
+
+# Teto de chamadas à rede por minuto (plano free/demo do Coingecko ~30/min).
+# Só quem vai à rede espera; hits de cache passam direto.
+COINGECKO_RATE_PER_MIN = int(os.environ.get("COINGECKO_RATE_PER_MIN", 25))
+
+# Política de retry no próprio adapter (urllib3): 429/5xx com backoff
+# exponencial + jitter, respeitando "Retry-After". Vale para todo GET da sessão.
+MAX_RETRIES = 6
+
+class _ThrottledRetry(Retry):
+    """Cada reenvio do urllib3 também passa pelo rate limit (conta na janela de 60s)."""
+    def increment(self, *args, **kwargs):
+        new = super().increment(*args, **kwargs)  # esgotou: levanta antes de consumir a janela
+        _throttle()
+        return new
+
+_retry = _ThrottledRetry(
+    total=MAX_RETRIES,
+    backoff_factor=0.8,
+    backoff_jitter=1.0,
+    backoff_max=60.0,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset(["GET"]),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
+# Sessão única (keep-alive): reaproveita a conexão TLS com o Coingecko entre
+# fetch_bulk_prices e os vários fetch_ohlc de cada ciclo.
+session = requests.Session()
+POOL_MAXSIZE = 32  # conexões keep-alive por host; teto útil de threads simultâneas
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE, pool_block=False, max_retries=_retry)
+session.mount("https://", _adapter)
+session.mount("http://", _adapter)
+session.headers.update({
+    "Connection": "keep-alive",
+    "Accept-Encoding": "gzip, deflate",
+})
+
 # Mapeamento rápido de symbols USDT -> id no Coingecko
-SYMBOL_TO_ID: Dict[str, str] = {
+_SYMBOL_TO_ID: Dict[str, str] = {
     "BTCUSDT": "bitcoin",
     "ETHUSDT": "ethereum",
     "BNBUSDT": "binancecoin",
@@ -27,7 +95,7 @@ SYMBOL_TO_ID: Dict[str, str] = {
     "TRXUSDT":  "tron",
     "SHIBUSDT": "shiba-inu",
     "AVAXUSDT": "avalanche-2",
-    "TONUSDT":  "toncoin",
+    "TONUSDT":  "the-open-network",
     "NEARUSDT": "near",
     "APTUSDT":  "aptos",
     "OPUSDT":   "optimism",
@@ -38,34 +106,108 @@ SYMBOL_TO_ID: Dict[str, str] = {
     "FTMUSDT":  "fantom",
     "ICPUSDT":  "internet-computer",
     "ETCUSDT":  "ethereum-classic",
+    "INJUSDT":  "injective-protocol",
+    "RNDRUSDT": "render-token",
+    "SEIUSDT":  "sei-network",
 }
 
-def _get_json(url: str, params: dict | None = None, retries: int = 6, base_delay: float = 0.8):
-    """GET com backoff para lidar com 429/5xx."""
-    for i in range(1, retries + 1):
-        try:
-            r = requests.get(url, params=params, timeout=20)
-            if r.status_code == 200:
-                return r.json()
-            if r.status_code == 429:
-                # respeita "Retry-After" se vier
-                ra = r.headers.get("Retry-After")
-                wait = float(ra) if ra else base_delay * (1.6 ** (i - 1))
-                print(f"⚠️ 429 {url} — aguardando {wait:.1f}s (tentativa {i}/{retries})")
-                time.sleep(wait)
-                continue
-            # outros 5xx: backoff
-            if 500 <= r.status_code < 600:
-                wait = base_delay * (1.6 ** (i - 1))
-                print(f"⚠️ {r.status_code} {url} — aguardando {wait:.1f}s (tentativa {i}/{retries})")
-                time.sleep(wait)
-                continue
+# somente leitura: to_cg_id é memoizado, então o mapa não pode mudar em runtime
+SYMBOL_TO_ID: Mapping[str, str] = MappingProxyType(_SYMBOL_TO_ID)
+# reverso (id -> symbol), constante como o mapa acima
+ID_TO_SYMBOL: Mapping[str, str] = MappingProxyType({cid: sym for sym, cid in _SYMBOL_TO_ID.items()})
+
+@lru_cache(maxsize=256)
+def to_cg_id(symbol: str) -> str:
+    """Symbol USDT -> id do Coingecko (memo limitado: também recebe símbolo vindo da API pública)."""
+    return SYMBOL_TO_ID.get(symbol, symbol.replace("USDT", "").lower())
+
+# cache de respostas em memória: (url, params) -> (instante, json)
+_resp_cache: Dict[Tuple[str, Tuple], Tuple[float, Any]] = {}
+_resp_cache_lock = threading.Lock()
+RESP_CACHE_MAX = 512
+
+# validadores HTTP da última resposta: (url, params) -> (ETag, Last-Modified, json).
+# Com eles o GET vira condicional; em 304 o corpo anterior é reaproveitado sem download/parse.
+_validators: Dict[Tuple[str, Tuple], Tuple[str | None, str | None, Any]] = {}
+VALIDATORS_MAX = 1024
+
+def clear_cache() -> None:
+    """Descarta respostas cacheadas e validadores HTTP."""
+    with _resp_cache_lock:
+        _resp_cache.clear()
+        _validators.clear()
+
+def clear_price_cache() -> None:
+    """Só as respostas com TTL (preços): OHLC e validadores ficam (ex.: /api/force-update)."""
+    with _resp_cache_lock:
+        _resp_cache.clear()
+
+_call_times: Deque[float] = deque()
+_rate_lock = threading.Lock()
+
+def _throttle() -> None:
+    """Janela deslizante de 60s com no máx. COINGECKO_RATE_PER_MIN chamadas."""
+    while True:
+        with _rate_lock:
+            now = time.monotonic()
+            while _call_times and now - _call_times[0] >= 60.0:
+                _call_times.popleft()
+            if len(_call_times) < max(1, COINGECKO_RATE_PER_MIN):
+                _call_times.append(now)
+                return
+            wait = 60.0 - (now - _call_times[0])
+        log.info("rate limit %d/min — aguardando %.1fs", COINGECKO_RATE_PER_MIN, wait)
+        time.sleep(wait)
+
+def _get_json(url: str, params: dict | None = None, expire_after: float | None = None):
+    """
+    GET na sessão compartilhada; retry/backoff ficam no adapter (_retry).
+    Com expire_after (s), respostas idênticas dentro do prazo não vão à rede.
+    Fora dele, se a última resposta trouxe ETag/Last-Modified, o GET é condicional (304 = corpo anterior).
+    """
+    key = (url, tuple(sorted((params or {}).items())))
+    if expire_after:
+        with _resp_cache_lock:
+            hit = _resp_cache.get(key)
+        if hit and time.monotonic() - hit[0] < expire_after:
+            return hit[1]
+    with _resp_cache_lock:
+        val = _validators.get(key)
+    headers = None
+    if val is not None:
+        headers = {}
+        if val[0]:
+            headers["If-None-Match"] = val[0]
+        if val[1]:
+            headers["If-Modified-Since"] = val[1]
+    _throttle()
+    try:
+        r = session.get(url, params=params, headers=headers, timeout=20)
+        if r.status_code == 304 and val is not None:
+            js = val[2]
+        else:
             r.raise_for_status()
-        except requests.RequestException as e:
-            wait = base_delay * (1.6 ** (i - 1))
-            print(f"⚠️ erro de rede {e} — aguardando {wait:.1f}s (tentativa {i}/{retries})")
-            time.sleep(wait)
-    raise RuntimeError(f"Falha ao obter {url} depois de {retries} tentativas")
+            js = orjson.loads(r.content)
+            etag, modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+            if etag or modified:
+                with _resp_cache_lock:
+                    if len(_validators) >= VALIDATORS_MAX and key not in _validators:
+                        _validators.clear()  # chaves mudam com `days` do delta; limpa em bloco
+                    _validators[key] = (etag, modified, js)
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
+        log.warning("falha GET %s params=%s: %s", url, params, e)
+        raise RuntimeError(f"Falha ao obter {url}: {e}") from e
+    if expire_after:
+        now = time.monotonic()
+        with _resp_cache_lock:
+            if len(_resp_cache) >= RESP_CACHE_MAX and key not in _resp_cache:
+                # símbolo arbitrário (/api/test-ai) cria chave nova: descarta vencidos, e tudo se não bastar
+                for k in [k for k, (t, _) in _resp_cache.items() if now - t >= expire_after]:
+                    del _resp_cache[k]
+                if len(_resp_cache) >= RESP_CACHE_MAX:
+                    _resp_cache.clear()
+            _resp_cache[key] = (now, js)
+    return js
 
 def chunked(lst: List[str], n: int) -> List[List[str]]:
     return [lst[i:i+n] for i in range(0, len(lst), n)]
@@ -74,18 +216,14 @@ def fetch_bulk_prices(symbols: List[str]) -> Dict[str, Dict]:
     """
     Retorna dict:
       { "BTCUSDT": {"usd": 110000.0, "usd_24h_change": -2.1, "usd_market_cap": ...}, ... }
-    Faz chamadas em lotes (até ~120 ids por request).
+    Uma única chamada para até PRICE_BATCH_SIZE ids (lotes só acima disso).
     """
     out: Dict[str, Dict] = {}
-    ids = []
-    sym_by_id: Dict[str, str] = {}
-    for sym in symbols:
-        cid = SYMBOL_TO_ID.get(sym, sym.replace("USDT", "").lower())
-        sym_by_id[cid] = sym
-        ids.append(cid)
-
-    # Coingecko suporta muitos ids; usamos lotes de 100 para sobrar margem.
-    for group in chunked(ids, 100):
+    ids = list(dict.fromkeys(to_cg_id(sym) for sym in symbols))  # sem ids repetidos na URL
+    # só símbolos fora do SYMBOL_TO_ID precisam de reverso por chamada
+    extra_by_id: Dict[str, str] = {to_cg_id(sym): sym for sym in symbols if sym not in SYMBOL_TO_ID}
+
+    for group in chunked(ids, PRICE_BATCH_SIZE):
         params = {
             "ids": ",".join(group),
             "vs_currencies": "usd",
@@ -93,9 +231,9 @@ def fetch_bulk_prices(symbols: List[str]) -> Dict[str, Dict]:
             "include_market_cap": "true",
         }
         url = f"{BASE}/simple/price"
-        js = _get_json(url, params=params)
+        js = _get_json(url, params=params, expire_after=PRICE_TTL_SEC)
         for cid, data in (js or {}).items():
-            sym = sym_by_id.get(cid)
+            sym = ID_TO_SYMBOL.get(cid) or extra_by_id.get(cid)
             if not sym:
                 continue
             out[sym] = {
@@ -112,5 +250,118 @@ def fetch_ohlc(coin_id: str, days: int = 30, vs: str = "usd") -> List[List[float
     """
     url = f"{BASE}/coins/{coin_id}/ohlc"
     js = _get_json(url, params={"vs_currency": vs, "days": str(days)})
-    # a API já retorna [timestamp, o, h, l, c]
-    return [[float(a), float(b), float(c), float(d), float(e)] for a, b, c, d, e in (js or [])]
+    # a API já retorna [timestamp, o, h, l, c] como números JSON (int/float);
+    # sem float() por célula — quem precisa de float64 converte em bloco (np.asarray)
+    return js if isinstance(js, list) else []
+
+def _sparkline_to_ohlc(prices: List[float], step_ms: int = 3_600_000) -> List[List[float]]:
+    """Série de preços (1 ponto/hora) -> [[ts, o, h, l, c], ...] com open = close anterior."""
+    n = len(prices)
+    # último ponto na hora cheia: ts estáveis dentro da hora (não mudam a cada chamada)
+    end = int(time.time() * 1000) // step_ms * step_ms
+    rows: List[List[float]] = []
+    prev = prices[0]
+    for i, c in enumerate(prices):
+        if c is None:
+            c = prev
+        o = prev
+        rows.append([end - (n - 1 - i) * step_ms, o, max(o, c), min(o, c), c])
+        prev = c
+    return rows
+
+def fetch_bulk_sparkline(symbols: List[str]) -> Dict[str, List[List[float]]]:
+    """
+    Pseudo-OHLC horário dos últimos 7d de vários símbolos num único
+    GET /coins/markets?sparkline=true (em vez de um /ohlc por símbolo).
+    O sparkline só traz preço: high/low saem de open/close, então o ATR fica
+    subestimado. As features do modelo usam só o close.
+    """
+    out: Dict[str, List[List[float]]] = {}
+    ids = list(dict.fromkeys(to_cg_id(sym) for sym in symbols))
+    extra_by_id: Dict[str, str] = {to_cg_id(sym): sym for sym in symbols if sym not in SYMBOL_TO_ID}
+
+    for group in chunked(ids, PRICE_BATCH_SIZE):
+        params = {
+            "vs_currency": "usd",
+            "ids": ",".join(group),
+            "sparkline": "true",
+            "per_page": str(len(group)),
+        }
+        js = _get_json(f"{BASE}/coins/markets", params=params)
+        for row in js or []:
+            cid = row.get("id")
+            sym = ID_TO_SYMBOL.get(cid) or extra_by_id.get(cid)
+            prices = (row.get("sparkline_in_7d") or {}).get("price") or []
+            if not sym or len(prices) < 2 or prices[0] is None:
+                continue
+            out[sym] = _sparkline_to_ohlc(prices)
+    return out
+
+# ----------------- aiohttp (opcional) -----------------
+# loop próprio numa thread daemon; a ClientSession nasce dentro dele e é
+# reaproveitada entre ciclos (mesmo papel do `session` acima)
+_aloop: asyncio.AbstractEventLoop | None = None
+_aloop_lock = threading.Lock()
+_asession = None
+
+def _get_aloop() -> asyncio.AbstractEventLoop:
+    global _aloop
+    with _aloop_lock:
+        if _aloop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="coingecko-aio", daemon=True).start()
+            _aloop = loop
+            atexit.register(_close_asession)
+    return _aloop
+
+def _close_asession() -> None:
+    if _aloop is not None and _asession is not None:
+        try:
+            asyncio.run_coroutine_threadsafe(_asession.close(), _aloop).result(timeout=5)
+        except Exception:
+            pass
+
+async def _aget_json(url: str, params: dict | None = None):
+    """GET via aiohttp com o mesmo rate limit e política de retry (429/5xx, Retry-After) do caminho síncrono."""
+    global _asession
+    import aiohttp
+    if _asession is None:
+        _asession = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=POOL_MAXSIZE, limit_per_host=16),
+            headers={"Accept-Encoding": "gzip, deflate"},
+            timeout=aiohttp.ClientTimeout(total=20),
+        )
+    for attempt in range(MAX_RETRIES + 1):
+        await asyncio.to_thread(_throttle)
+        backoff = min(_retry.backoff_max, 0.8 * 2 ** attempt) + random.uniform(0, 1.0)
+        try:
+            async with _asession.get(url, params=params) as r:
+                if r.status in _retry.status_forcelist and attempt < MAX_RETRIES:
+                    ra = r.headers.get("Retry-After", "")
+                    await asyncio.sleep(float(ra) if ra.isdigit() else backoff)
+                    continue
+                r.raise_for_status()
+                return orjson.loads(await r.read())
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if attempt < MAX_RETRIES:
+                await asyncio.sleep(backoff)
+                continue
+            log.warning("falha GET %s params=%s: %s", url, params, e)
+            raise RuntimeError(f"Falha ao obter {url}: {e}") from e
+        except (aiohttp.ClientError, orjson.JSONDecodeError) as e:
+            log.warning("falha GET %s params=%s: %s", url, params, e)
+            raise RuntimeError(f"Falha ao obter {url}: {e}") from e
+
+async def _afetch_ohlc(coin_id: str, days: int, vs: str = "usd") -> List[List[float]]:
+    js = await _aget_json(f"{BASE}/coins/{coin_id}/ohlc", params={"vs_currency": vs, "days": str(days)})
+    return js if isinstance(js, list) else []
+
+def fetch_ohlc_many(reqs: List[Tuple[str, int]], vs: str = "usd") -> List[Any]:
+    """
+    Vários fetch_ohlc concorrentes: reqs = [(coin_id, days), ...].
+    Retorna na mesma ordem a lista OHLC ou a exceção daquele item.
+    """
+    async def _all():
+        return await asyncio.gather(*(_afetch_ohlc(cid, days, vs) for cid, days in reqs),
+                                    return_exceptions=True)
+    return asyncio.run_coroutine_threadsafe(_all(), _get_aloop()).result()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Kernel numérico das features de predição (mesmas 15 features de
+predict_enhanced.calculate_features_for_prediction), compilado com numba.
+Recebe a matriz OHLC (n, 5) float64 [ts, open, high, low, close] e devolve
+o vetor de features do último candle. Sem numba, roda como Python puro.
+"""
+import os
+import numpy as np
+
+# cache de compilação em disco: só o primeiro processo paga o JIT
+os.environ.setdefault("NUMBA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".numba_cache"))
+
+try:
+    from numba import njit, prange
+except ImportError:  # numba ausente: mesmas funções, interpretadas
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda fn: fn
+    prange = range
+
+N_FEATURES = 15
+# fastmath sem nnan/ninf: NaN de candle faltando tem que chegar ao chamador (atr != atr etc.)
+_FASTMATH = {"contract", "reassoc"}
+
+@njit("float64(float64[:], int64)", cache=True, fastmath=_FASTMATH)
+def _ema_last(x, period):
+    k = 2.0 / (period + 1)
+    prev = x[0]
+    for i in range(1, x.shape[0]):
+        prev = x[i] * k + prev * (1 - k)
+    return prev
+
+@njit("float64(float64[:], int64)", cache=True, fastmath=_FASTMATH)
+def _rsi_last(x, period):
+    # replica indicators.rsi (inclusive o deslocamento de índice do original)
+    n = x.shape[0]
+    avg_gain = 0.0
+    avg_loss = 0.0
+    for j in range(1, period + 1):
+        ch = x[j] - x[j - 1]
+        if ch > 0:
+            avg_gain += ch
+        else:
+            avg_loss -= ch
+    avg_gain /= period
+    avg_loss /= period
+    rsi_val = 50.0
+    for i in range(period, n - 1):
+        ch = x[i] - x[i - 1]
+        gain = ch if ch > 0 else 0.0
+        loss = -ch if ch < 0 else 0.0
+        avg_gain = (avg_gain * (period - 1) + gain) / period
+        avg_loss = (avg_loss * (period - 1) + loss) / period
+        if avg_loss == 0:
+            rsi_val = 100.0
+        else:
+            rsi_val = 100 - (100 / (1 + avg_gain / avg_loss))
+    return rsi_val
+
+@njit("float64[:](float64[:, :])", cache=True, fastmath=_FASTMATH)
+def compute_features(ohlc):
+    """Vetor (15,) de features do último candle; exige n >= 60."""
+    closes = np.ascontiguousarray(ohlc[:, 4])
+    n = closes.shape[0]
+    out = np.empty(N_FEATURES)
+
+    # MACD(12, 26, 9): EMA da linha MACD inteira
+    kf = 2.0 / 13
+    ks = 2.0 / 27
+    kg = 2.0 / 10
+    fast = closes[0]
+    slow = closes[0]
+    sig = 0.0
+    for i in range(n):
+        if i > 0:
+            fast = closes[i] * kf + fast * (1 - kf)
+            slow = closes[i] * ks + slow * (1 - ks)
+        m = fast - slow
+        sig = m if i == 0 else m * kg + sig * (1 - kg)
+    macd_line = fast - slow
+
+    ema20 = _ema_last(closes, 20)
+    ema50 = _ema_last(closes, 50)
+
+    # Bollinger(20, 2.0) com desvio populacional; volatilidade com ddof=1 (pandas)
+    s = 0.0
+    for i in range(n - 20, n):
+        s += closes[i]
+    bb_mid = s / 20
+    ss = 0.0
+    for i in range(n - 20, n):
+        d = closes[i] - bb_mid
+        ss += d * d
+    bb_std = np.sqrt(ss / 20)
+    volatility = np.sqrt(ss / 19)
+
+    s10 = 0.0
+    for i in range(n - 10, n):
+        s10 += closes[i]
+
+    price = closes[n - 1]
+    out[0] = _rsi_last(closes, 14)
+    out[1] = macd_line
+    out[2] = sig
+    out[3] = macd_line - sig
+    out[4] = ema20
+    out[5] = ema50
+    out[6] = bb_mid + 2.0 * bb_std
+    out[7] = bb_mid
+    out[8] = bb_mid - 2.0 * bb_std
+    out[9] = s10 / 10
+    out[10] = (price - closes[n - 2]) / closes[n - 2] * 100
+    out[11] = volatility
+    out[12] = price / ema20 - 1
+    out[13] = price / bb_mid - 1
+    out[14] = (out[6] - out[8]) / bb_mid
+    return out
+
+@njit("float64[:, :](float64[:, :, :], int64[:])", cache=True, fastmath=_FASTMATH, parallel=True)
+def batch_compute_features(stacked, lengths):
+    """
+    Features de vários símbolos de uma vez: stacked (n_symbols, max_bars, 5)
+    preenchido no fim, lengths[i] = candles válidos do símbolo i.
+    """
+    n_sym = stacked.shape[0]
+    out = np.empty((n_sym, N_FEATURES))
+    for i in prange(n_sym):
+        out[i, :] = compute_features(stacked[i, :lengths[i], :])
+    return out
+
+# buffer de empilhamento reaproveitado entre ciclos (só cresce)
+_stack_buf = np.empty((0, 0, 5))
+
+def stack_ohlc(arrays):
+    """
+    Empilha matrizes OHLC de tamanhos diferentes (padding no fim) para batch_compute_features.
+    Devolve uma visão do buffer do módulo: vale até a próxima chamada (só o updater chama).
+    """
+    global _stack_buf
+    lengths = np.array([a.shape[0] for a in arrays], dtype=np.int64)
+    n, bars = len(arrays), int(lengths.max()) if len(arrays) else 0
+    if _stack_buf.shape[0] < n or _stack_buf.shape[1] < bars:
+        _stack_buf = np.empty((max(n, _stack_buf.shape[0]), max(bars, _stack_buf.shape[1]), 5))
+    stacked = _stack_buf[:n, :bars]
+    for i, a in enumerate(arrays):
+        stacked[i, :a.shape[0]] = a
+    return stacked, lengths
+
+@njit("float64[:](float64[:], int64)", cache=True, fastmath=_FASTMATH)
+def ema_series(x, period):
+    """EMA semeada pela SMA dos primeiros `period` valores (len(x) - period + 1 pontos)."""
+    n = x.shape[0]
+    if n < period:
+        return np.empty(0)
+    k = 2.0 / (period + 1)
+    out = np.empty(n - period + 1)
+    s = 0.0
+    for i in range(period):
+        s += x[i]
+    s /= period
+    out[0] = s
+    for i in range(period, n):
+        s = x[i] * k + s * (1 - k)
+        out[i - period + 1] = s
+    return out
+
+@njit("float64(float64[:, :], int64)", cache=True, fastmath=_FASTMATH)
+def atr_last(ohlc, period):
+    """ATR de Wilder do último candle; exige n >= period + 1."""
+    n = ohlc.shape[0]
+    tr = np.empty(n - 1)
+    for i in range(1, n):
+        h = ohlc[i, 2]
+        l = ohlc[i, 3]
+        pc = ohlc[i - 1, 4]
+        tr[i - 1] = max(h - l, abs(h - pc), abs(l - pc))
+    atr = 0.0
+    for i in range(period):
+        atr += tr[i]
+    atr /= period
+    for i in range(period, n - 1):
+        atr = (atr * (period - 1) + tr[i]) / period
+    return atr
@@ -3,21 +3,25 @@ from typing import List
 
 def ema(series: List[float], period: int):
     k = 2 / (period + 1)
-    ema_vals = []
-    prev = None
-    for price in series:
-        prev = price if prev is None else price * k + prev * (1 - k)
-        ema_vals.append(prev)
+    n = len(series)
+    if n == 0:
+        return []
+    # lista já no tamanho final: atribuição por índice em vez de append
+    ema_vals = [0.0] * n
+    prev = ema_vals[0] = series[0]
+    for i in range(1, n):
+        prev = series[i] * k + prev * (1 - k)
+        ema_vals[i] = prev
     return ema_vals
 
 def rsi(series: List[float], period: int = 14):
     if len(series) < period + 1:
         return [None] * len(series)
-    gains, losses = [], []
+    gains, losses = [0] * (len(series) - 1), [0] * (len(series) - 1)
     for i in range(1, len(series)):
         ch = series[i] - series[i-1]
-        gains.append(max(ch, 0))
-        losses.append(max(-ch, 0))
+        gains[i-1] = max(ch, 0)
+        losses[i-1] = max(-ch, 0)
     avg_gain = sum(gains[:period]) / period
     avg_loss = sum(losses[:period]) / period
     rsis = [None]*(period)
@@ -47,17 +51,14 @@ def bollinger(series: List[float], period=20, mult=2.0):
     if len(series) < period:
         n = len(series)
         return [None]*n, [None]*n, [None]*n
-    sma, stds = [], []
+    sma, stds = [None] * len(series), [None] * len(series)
     from math import sqrt
-    for i in range(len(series)):
-        if i < period-1:
-            sma.append(None); stds.append(None)
-        else:
-            window = series[i-period+1:i+1]
-            m = sum(window)/period
-            sma.append(m)
-            var = sum((x-m)**2 for x in window)/period
-            stds.append(sqrt(var))
+    for i in range(period-1, len(series)):
+        window = series[i-period+1:i+1]
+        m = sum(window)/period
+        sma[i] = m
+        var = sum((x-m)**2 for x in window)/period
+        stds[i] = sqrt(var)
     upper = [ (m + mult*s) if m is not None and s is not None else None for m,s in zip(sma,stds) ]
     lower = [ (m - mult*s) if m is not None and s is not None else None for m,s in zip(sma,stds) ]
     return upper, sma, lower
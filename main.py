@@ -10,15 +10,36 @@ Recursos:
 - Envio forçado via HTTP (TELEGRAM_FORCE_HTTP) para suportar parse_mode e reply_markup
 - Endpoints: /, /api/predictions, /api/status, /api/force-update, /api/test-ai, /health
 - Dashboard dark
-- **NOVO**: Cache OHLC com TTL + rodízio de símbolos por ciclo + pausas anti-burst
+- **NOVO**: Cache OHLC com TTL + rodízio de símbolos por ciclo + rate limit anti-burst no coingecko_client
 """
 
-import os, sys, time, json, threading, requests
-from math import isnan
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Tuple, Set
-from flask import Flask, jsonify, render_template_string, request
-from flask_cors import CORS
+import os, sys, time, gzip, hashlib, atexit, threading, logging, queue, uuid, requests
+import orjson
+import numpy as np
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime
+from typing import List, Dict, Any, Deque, Tuple, Set
+from flask import Flask, Response, request, stream_with_context
+
+# logs passam por uma fila: quem loga só enfileira; a escrita no stdout
+# fica na thread do QueueListener (fora do ciclo e dos requests)
+_log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+_log_stream = logging.StreamHandler(sys.stdout)
+_log_stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    format="%(message)s",  # formatação completa fica no _log_stream
+    handlers=[QueueHandler(_log_queue)],
+)
+_log_listener = QueueListener(_log_queue, _log_stream, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+log = logging.getLogger("main")
 
 # ----------------- Config por ENV -----------------
 ALERT_MODE = os.environ.get("ALERT_MODE", "balanceado").lower()
@@ -48,6 +69,11 @@ elif ALERT_MODE == "agressivo":
 # Overrides finos
 ALERT_CONF_MIN = float(os.environ.get("ALERT_CONF_MIN", ALERT_CONF_MIN))
 ALERT_COOLDOWN_MIN = int(os.environ.get("ALERT_COOLDOWN_MIN", ALERT_COOLDOWN_MIN))
+ALERT_COOLDOWN_SEC = ALERT_COOLDOWN_MIN * 60.0
+
+# lado do sinal como código int8 para o gatilho vetorizado (0=COMPRA, 1=VENDA)
+_SIDES = ("COMPRA", "VENDA")
+_SIDE_CODES = {side: code for code, side in enumerate(_SIDES)}
 UPDATE_INTERVAL_SEC = int(os.environ.get("UPDATE_INTERVAL_SECONDS", UPDATE_INTERVAL_SEC))
 USE_ATR_LEVELS = os.environ.get("USE_ATR_LEVELS", str(USE_ATR_LEVELS)).lower() in {"1","true","yes","on"}
 ATR_PERIOD = int(os.environ.get("ATR_PERIOD", ATR_PERIOD))
@@ -60,7 +86,21 @@ SL_PCT = float(os.environ.get("SL_PCT", SL_PCT))
 SYMBOLS_PER_CYCLE = int(os.environ.get("SYMBOLS_PER_CYCLE", 8))
 OHLC_DAYS = int(os.environ.get("OHLC_DAYS", 14))
 OHLC_TTL_SEC = int(os.environ.get("OHLC_TTL_SEC", 900))  # 15 min
-INTER_SYMBOL_SLEEP = float(os.environ.get("INTER_SYMBOL_SLEEP", 0.7))  # pausa entre símbolos (anti-burst)
+OHLC_CACHE_MAX = int(os.environ.get("OHLC_CACHE_MAX", 512))  # símbolos no cache OHLC
+OHLC_FULL_REFRESH_SEC = int(os.environ.get("OHLC_FULL_REFRESH_SEC", 6 * 3600))  # recarga completa; no meio, só o delta
+OHLC_CONCURRENCY = int(os.environ.get("OHLC_CONCURRENCY", 4))  # fetch_ohlc simultâneos por ciclo
+# OHLC do ciclo via aiohttp num event loop em background (threads ficam de fallback)
+OHLC_ASYNC = os.environ.get("OHLC_ASYNC", "0").lower() in {"1","true","yes","on"}
+# sparkline (7d horário) não serve ao modelo: treinado em candles de 4h, e 7d de 4h são só 42
+# candles (< 60 exigidos); candle de 1h com ts sintético ainda quebraria o reaproveitamento por candle
+USE_SPARKLINE = False
+if os.environ.get("USE_SPARKLINE", "0").lower() in {"1","true","yes","on"}:
+    log.warning("⚠️ USE_SPARKLINE ignorado: sparkline não tem a granularidade do modelo, usando /ohlc")
+# cadência em camadas: símbolo "frio" (confiança < COLD_CONF_MAX por COLD_STREAK vezes
+# seguidas) pula as próximas COLD_SKIP_ROUNDS vezes que o rodízio chegaria nele (0 = desliga)
+COLD_CONF_MAX = float(os.environ.get("COLD_CONF_MAX", 0.3))
+COLD_STREAK = int(os.environ.get("COLD_STREAK", 3))
+COLD_SKIP_ROUNDS = int(os.environ.get("COLD_SKIP_ROUNDS", 0))
 
 # Rótulos e integrações
 TIMEFRAME      = os.environ.get("TIMEFRAME", "H1")
@@ -72,6 +112,7 @@ TG_CHAT        = os.environ.get("TELEGRAM_CHAT_ID")
 ALERT_TEMPLATE = os.environ.get("ALERT_TEMPLATE", "card").lower()  # pro | card | compact
 APP_BASE_URL   = os.environ.get("APP_BASE_URL")  # ex: https://seu-projeto.up.railway.app
 TELEGRAM_FORCE_HTTP = os.environ.get("TELEGRAM_FORCE_HTTP", "1").lower() in {"1","true","yes","on"}
+TG_MAX_429_RETRIES = int(os.environ.get("TG_MAX_429_RETRIES", 3))  # reenvios após "Too Many Requests"
 
 # Formatação numérica (padrão: ponto)
 NUMBER_FORMAT = os.environ.get("NUMBER_FORMAT", "dot").lower()  # dot | comma
@@ -79,11 +120,15 @@ NUMBER_FORMAT = os.environ.get("NUMBER_FORMAT", "dot").lower()  # dot | comma
 # ----------------- Imports do projeto -----------------
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 try:
-    from predict_enhanced import predict_signal, load_model_and_scaler
-    from coingecko_client import fetch_bulk_prices, fetch_ohlc, SYMBOL_TO_ID
+    from predict_enhanced import predict_signal, predict_signals, load_model_and_scaler
+    from features import atr_last, ema_series
+    from coingecko_client import (fetch_bulk_prices, fetch_ohlc,
+                                  to_cg_id, clear_price_cache, fetch_ohlc_many, COINGECKO_RATE_PER_MIN, POOL_MAXSIZE)
     from config import SYMBOLS
+    # symbol -> id do Coingecko resolvido 1x (fora do caminho quente do ciclo)
+    _COIN_IDS: Dict[str, str] = {s: to_cg_id(s) for s in SYMBOLS}
 except ImportError as e:
-    print(f"❌ Import error: {e}")
+    log.error("❌ Import error: %s", e)
 
 # ----------------- Utils: HTML escape para Telegram -----------------
 def html_escape(s: str) -> str:
@@ -91,6 +136,11 @@ def html_escape(s: str) -> str:
         return ""
     return (str(s).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;"))
 
+@lru_cache(maxsize=256)
+def html_const(s: str) -> str:
+    """html_escape memoizado, para o conjunto fechado de textos (lado, símbolo, timeframe, rótulos)."""
+    return html_escape(s)
+
 # ----------------- Integração Telegram -----------------
 _tg_fn = None
 try:
@@ -104,22 +154,47 @@ except Exception:
         except Exception:
             _tg_fn = None
 
-def _notify_telegram_fallback(text: str, parse_mode: str = "HTML", reply_markup: dict | None = None):
+# sessão única para a API do Telegram (reaproveita TCP/TLS entre alertas).
+# Retry cobre só falhas de conexão: POST não está em allowed_methods, então
+# uma mensagem já entregue nunca é reenviada.
+_tg_session = requests.Session()
+_tg_session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32,
+                                          max_retries=Retry(total=3, backoff_factor=0.3)))
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+def _notify_telegram_fallback(text: str, parse_mode: str = "HTML", reply_markup: dict | None = None) -> bool:
     if not (TG_TOKEN and TG_CHAT):
-        return
+        return False
     try:
         url = f"https://api.telegram.org/bot{TG_TOKEN}/sendMessage"
         data = {"chat_id": TG_CHAT, "text": text, "parse_mode": parse_mode}
         if reply_markup:
             data["reply_markup"] = reply_markup
-        requests.post(url, json=data, timeout=12)
+        body = orjson.dumps(data)  # serializado 1x, reaproveitado nos reenvios de 429
+        for _ in range(TG_MAX_429_RETRIES + 1):
+            r = _tg_session.post(url, data=body, headers=_JSON_HEADERS, timeout=12)
+            if r.status_code != 429:
+                break
+            # flood control: o Telegram diz quanto esperar (corpo ou header Retry-After)
+            try:
+                wait = r.json().get("parameters", {}).get("retry_after")
+            except ValueError:
+                wait = None
+            wait = float(wait or r.headers.get("Retry-After") or 1)
+            log.warning("⏳ Telegram 429: aguardando %ss", wait)
+            time.sleep(wait)
+        if r.status_code != 200:
+            log.warning("⚠️ Telegram fallback status=%s: %s", r.status_code, r.text[:200])
+        return r.status_code == 200
     except Exception as e:
-        print(f"⚠️ Telegram fallback erro: {e}")
+        log.warning("⚠️ Telegram fallback erro: %s", e)
+        return False
 
-def notify_telegram_message(text: str, payload: dict | None = None, parse_mode: str = "HTML", reply_markup: dict | None = None):
+def notify_telegram_message(text: str, payload: dict | None = None, parse_mode: str = "HTML", reply_markup: dict | None = None) -> bool:
+    """Envia uma mensagem; True se o Telegram aceitou."""
     if TELEGRAM_FORCE_HTTP or not callable(_tg_fn):
-        _notify_telegram_fallback(text, parse_mode=parse_mode, reply_markup=reply_markup)
-        return
+        return _notify_telegram_fallback(text, parse_mode=parse_mode, reply_markup=reply_markup)
     try:
         if payload is None:
             payload = {"text": text, "parse_mode": parse_mode}
@@ -127,102 +202,325 @@ def notify_telegram_message(text: str, payload: dict | None = None, parse_mode:
             payload = {**payload, "text": text, "parse_mode": parse_mode}
         if reply_markup:
             payload["reply_markup"] = reply_markup
-        _tg_fn(payload)
+        ok = _tg_fn(payload)
+        # notificadores antigos não retornam nada: sem exceção = enviado
+        return ok is None or bool(ok)
     except TypeError:
-        _notify_telegram_fallback(text, parse_mode=parse_mode, reply_markup=reply_markup)
+        return _notify_telegram_fallback(text, parse_mode=parse_mode, reply_markup=reply_markup)
     except Exception as e:
-        print(f"⚠️ erro ao enviar telegram: {e}")
-        _notify_telegram_fallback(text, parse_mode=parse_mode, reply_markup=reply_markup)
+        log.warning("⚠️ erro ao enviar telegram: %s", e)
+        return _notify_telegram_fallback(text, parse_mode=parse_mode, reply_markup=reply_markup)
+
+TG_MAX_LEN = 4096  # limite do sendMessage, em unidades UTF-16 (emoji = 2)
+
+def _tg_len(text: str) -> int:
+    """Tamanho como o Telegram conta: unidades UTF-16, não caracteres Python."""
+    return len(text.encode("utf-16-le")) // 2
+
+def _pack_under_4096(alerts: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Agrupa alertas em lotes cujo texto (separado por linha em branco) cabe numa mensagem."""
+    chunks: List[List[Dict[str, Any]]] = []
+    size = 0
+    for a in alerts:
+        n = _tg_len(a["text"])
+        if chunks and size + 2 + n <= TG_MAX_LEN:
+            chunks[-1].append(a)
+            size += 2 + n
+        else:
+            chunks.append([a])
+            size = n
+    return chunks
+
+def _send_chunk(chunk: List[Dict[str, Any]], now: float) -> None:
+    """Um sendMessage; alerta sozinho sai como antes, com botões."""
+    try:
+        if len(chunk) == 1:
+            a = chunk[0]
+            ok = notify_telegram_message(a["text"], payload=a["content"], parse_mode="HTML", reply_markup=a["kb"])
+        else:
+            ok = notify_telegram_message("\n\n".join(a["text"] for a in chunk), parse_mode="HTML")
+        if ok:
+            # cooldown/assinatura só avançam se o envio deu certo
+            for a in chunk:
+                _alert_state[a["symbol"]] = (now, a["sig"])
+            _persist_alerts([a["symbol"] for a in chunk])
+    finally:
+        # gravado o estado (ou falhou o envio): o símbolo volta a ser avaliado pelo cooldown
+        for a in chunk:
+            _alert_pending.discard(a["symbol"])
+
+# envios do Telegram saem numa thread própria: o ciclo de predição não espera HTTP
+# limitada: com o Telegram fora do ar, o ciclo não acumula alertas sem fim
+_tg_q: "queue.Queue[Tuple[List[Dict[str, Any]], float]]" = queue.Queue(maxsize=int(os.environ.get("TG_QUEUE_MAX", 256)))
+
+# limites do Telegram para um mesmo chat: ~1 msg/s e 20 msg/min (grupos)
+TG_MIN_INTERVAL_SEC = float(os.environ.get("TG_MIN_INTERVAL_SEC", 1.0))
+TG_RATE_PER_MIN = int(os.environ.get("TG_RATE_PER_MIN", 20))
+_tg_sent: Deque[float] = deque()  # instantes (monotonic) dos envios no último minuto
+
+def _tg_pace() -> None:
+    """Espera até o próximo envio caber nas duas janelas (só a thread do Telegram chama)."""
+    now = time.monotonic()
+    while _tg_sent and now - _tg_sent[0] >= 60.0:
+        _tg_sent.popleft()
+    wait = 0.0
+    if _tg_sent:
+        wait = TG_MIN_INTERVAL_SEC - (now - _tg_sent[-1])
+    if len(_tg_sent) >= max(1, TG_RATE_PER_MIN):
+        wait = max(wait, 60.0 - (now - _tg_sent[0]))
+    if wait > 0:
+        time.sleep(wait)
+    _tg_sent.append(time.monotonic())
+
+def _tg_worker():
+    while True:
+        chunk, now = _tg_q.get()
+        try:
+            _tg_pace()
+            _send_chunk(chunk, now)
+        except Exception:
+            log.exception("❌ Erro no envio ao Telegram")
+
+def send_alerts(alerts: List[Dict[str, Any]], now: float) -> None:
+    """Enfileira os alertas do ciclo em lotes de um sendMessage (em vez de um POST por símbolo)."""
+    for chunk in _pack_under_4096(alerts):
+        # na fila/em envio: ciclos seguintes não repetem o alerta até _send_chunk terminar
+        for a in chunk:
+            _alert_pending.add(a["symbol"])
+        try:
+            _tg_q.put_nowait((chunk, now))
+        except queue.Full:
+            # sem envio, cooldown/assinatura não avançam: o alerta volta a disparar
+            for a in chunk:
+                _alert_pending.discard(a["symbol"])
+            log.warning("⚠️ Fila do Telegram cheia; descartando %s alerta(s)", len(chunk))
 
 # ----------------- App e estado -----------------
 app = Flask(__name__)
-CORS(app)
+
+# CORS aberto (só GETs públicos): cabeçalhos fixos, sem a maquinaria do flask-cors por request
+@app.after_request
+def _cors(resp: Response) -> Response:
+    resp.headers["Access-Control-Allow-Origin"] = "*"
+    resp.headers["Access-Control-Allow-Methods"] = "GET, OPTIONS"
+    return resp
 
 # cache predições (mantém último valor de todos)
 predictions_cache: List[Dict[str, Any]] = []
 last_update: datetime | None = None
+last_update_iso: str | None = None  # isoformat() de last_update, calculado 1x por ciclo
+# snapshot de /api/predictions trocado de uma vez por ciclo (leitores nunca veem metade):
+# (payload dict, corpo orjson, corpo gzip, etag, time.monotonic() da atualização)
+_pred_snapshot: Tuple[Dict[str, Any], bytes, bytes, str, float] = ({}, b"", b"", "", 0.0)
 model = None
 scaler = None
-_last_alert_time: Dict[str, datetime] = {}
-_last_alert_sig:  Dict[str, Tuple] = {}
+# último alerta enviado por símbolo: (time.monotonic(), assinatura (lado, entry, tp, sl) em 1e-6)
+_alert_state: Dict[str, Tuple[float, Tuple]] = {}
+# símbolos com alerta enfileirado/em envio (o estado acima só é gravado depois da confirmação)
+_alert_pending: set = set()
+
+# primeiro ciclo concluído (antes disso /api/predictions responde 202)
+_first_refresh = threading.Event()
+class _UpdateRequest(threading.Event):
+    """Pedido de ciclo; `ran` diz se este processo rodou o ciclo (False = não era o dono)."""
+    ran = False
+
+# pedidos de atualização (force-update) drenados pelo background_updater;
+# cada pedido é sinalizado quando o ciclo que o atendeu termina
+_update_requests: "queue.Queue[_UpdateRequest]" = queue.Queue()
+FORCE_UPDATE_WAIT_SEC = float(os.environ.get("FORCE_UPDATE_WAIT_SEC", 60))
+# ciclo rodando agora no background_updater
+_update_in_flight = threading.Event()
+# predições mais velhas que isso saem com "stale": true e cutucam o updater
+PREDICTIONS_STALE_SEC = float(os.environ.get("PREDICTIONS_STALE_SEC", 2 * UPDATE_INTERVAL_SEC))
+# a partir de quantos símbolos a resposta montada por request sai em streaming
+PREDICTIONS_STREAM_MIN = int(os.environ.get("PREDICTIONS_STREAM_MIN", 200))
+
+# Redis (opcional): com vários workers, um só roda o ciclo e publica o JSON pronto
+REDIS_URL = os.environ.get("REDIS_URL", "")
+_REDIS_PRED_KEY = "pred:v1"
+_REDIS_LOCK_KEY = "pred:updater"
+_REDIS_ALERTS_KEY = "pred:alerts"
+_PROCESS_TAG = uuid.uuid4().hex
+_redis = None
+if REDIS_URL:
+    try:
+        import redis
+        _redis = redis.Redis.from_url(REDIS_URL, socket_timeout=2)
+    except Exception as e:
+        log.warning("⚠️ Redis indisponível, cache só em memória: %s", e)
+_is_owner = _redis is None  # este processo roda o ciclo?
+# renova o lock só se ainda for nosso (GET + EXPIRE atômicos no servidor)
+_RENEW_LOCK_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_renew_lock = _redis.register_script(_RENEW_LOCK_LUA) if _redis is not None else None
+
+# _alert_state é por processo: com Redis, o dono espelha os cooldowns no hash pred:alerts
+# (instante em relógio de parede) e quem assume o ciclo os recarrega, sem reenviar alertas
+def _persist_alerts(symbols: List[str]) -> None:
+    if _redis is None or not symbols:
+        return
+    wall_off = time.time() - time.monotonic()
+    try:
+        mapping = {}
+        for sym in symbols:
+            st = _alert_state.get(sym)
+            if st is not None:
+                mapping[sym] = orjson.dumps([st[0] + wall_off, st[1]], option=orjson.OPT_SERIALIZE_NUMPY)
+        if mapping:
+            _redis.hset(_REDIS_ALERTS_KEY, mapping=mapping)
+            _redis.expire(_REDIS_ALERTS_KEY, int(10 * ALERT_COOLDOWN_SEC) + 60)
+    except Exception as e:
+        log.warning("⚠️ Redis: falha ao salvar cooldowns: %s", e)
 
-# cache OHLC
+def _restore_alerts() -> None:
+    if _redis is None:
+        return
+    wall_off = time.time() - time.monotonic()
+    try:
+        raw = _redis.hgetall(_REDIS_ALERTS_KEY)
+    except Exception as e:
+        log.warning("⚠️ Redis: falha ao ler cooldowns: %s", e)
+        return
+    for sym, val in raw.items():
+        try:
+            wall, sig = orjson.loads(val)
+            sym = sym.decode()
+            wall = float(wall)
+            sig = tuple(sig)
+        except Exception as e:
+            # valor corrompido/de outra versão: ignora só esta entrada
+            log.warning("⚠️ Redis: cooldown inválido em %s (%r): %s", _REDIS_ALERTS_KEY, sym, e)
+            continue
+        prev = _alert_state.get(sym)
+        if prev is None or prev[0] < wall - wall_off:
+            _alert_state[sym] = (wall - wall_off, sig)
+
+# último candle (ts, o, h, l, c) e predição por símbolo: candle igual => não prediz de novo
+_last_ohlc_tail: Dict[str, Tuple] = {}
+_prediction_by_symbol: Dict[str, Dict[str, Any]] = {}
+# ATR de Wilder até o penúltimo candle (já fechado): symbol -> (ts desse candle, atr)
+_atr_state: Dict[str, Tuple[float, float]] = {}
+# indicadores do alerta (ATR, SMA20/50, MACD) por símbolo, válidos enquanto o último candle não mudar
+_indicators_by_symbol: Dict[str, Tuple[Tuple, Dict[str, float | None]]] = {}
+
+# cache OHLC: symbol -> {"ts": time.time() da última busca, "full_ts": da última carga completa, "data": linhas}
 _ohlc_cache: Dict[str, Dict[str, Any]] = {}
 _cycle_idx = 0  # round-robin
+_cold_streak: Dict[str, int] = {}  # análises seguidas com confiança < COLD_CONF_MAX
+_cold_skip: Dict[str, int] = {}    # vezes no rodízio que o símbolo ainda vai pular
 
 # ----------------- Utils: médias, MACD, ATR -----------------
-def ema(values: List[float], period: int) -> List[float]:
-    if len(values) < period: return []
-    k = 2 / (period + 1)
-    out = []
-    s = sum(values[:period]) / period
-    out.append(s)
-    for v in values[period:]:
-        s = v * k + s * (1 - k)
-        out.append(s)
-    return out
-
-def sma(values: List[float], period: int) -> List[float]:
-    if len(values) < period: return []
-    out = []
-    s = sum(values[:period])
-    out.append(s / period)
-    for i in range(period, len(values)):
-        s += values[i] - values[i - period]
-        out.append(s / period)
-    return out
-
-def macd(values: List[float], fast=12, slow=26, signal=9) -> Tuple[List[float], List[float]]:
-    if len(values) < slow + signal: return [], []
-    ema_fast = ema(values, fast)
+def ema(values: np.ndarray, period: int) -> np.ndarray:
+    # recursão compilada (features.ema_series); exige float64 contíguo
+    return ema_series(np.ascontiguousarray(values, dtype=np.float64), period)
+
+def sma(values: np.ndarray, period: int) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < period: return values[:0]
+    return np.convolve(values, np.full(period, 1.0 / period), mode="valid")
+
+def macd(values: np.ndarray, fast=12, slow=26, signal=9) -> Tuple[np.ndarray, np.ndarray]:
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < slow + signal: return values[:0], values[:0]
     ema_slow = ema(values, slow)
-    offs = len(ema_fast) - len(ema_slow)
-    if offs > 0: ema_fast = ema_fast[offs:]
-    elif offs < 0: ema_slow = ema_slow[-offs:]
-    line = [a - b for a, b in zip(ema_fast, ema_slow)]
+    # alinha pelo fim: as duas EMAs terminam no último candle
+    line = ema(values, fast)[-len(ema_slow):] - ema_slow
     sig = ema(line, signal)
-    offs2 = len(line) - len(sig)
-    if offs2 > 0: line = line[offs2:]
-    return line, sig
-
-def _wilder_ema(prev: float, value: float, period: int) -> float:
-    return (prev * (period - 1) + value) / period
-
-def compute_atr(candles: List[List[float]], period: int = 14) -> float | None:
-    n = len(candles)
-    if n < period + 1: return None
-    trs: List[float] = []
-    for i in range(1, n):
-        _, o, h, l, c = candles[i]
-        _, po, ph, pl, pc = candles[i - 1]
-        tr = max(h - l, abs(h - pc), abs(l - pc))
-        trs.append(float(tr))
-    if len(trs) < period: return None
-    atr = sum(trs[:period]) / period
-    for tr in trs[period:]:
-        atr = _wilder_ema(atr, tr, period)
-    if atr is None or isnan(atr): return None
+    return line[-len(sig):], sig
+
+def compute_atr(candles: List[List[float]] | np.ndarray, period: int = 14) -> float | None:
+    arr = np.asarray(candles, dtype=np.float64)
+    if len(arr) < period + 1: return None
+    # TR + recursão de Wilder num único laço compilado (features.atr_last)
+    atr = atr_last(arr, period)
+    if atr != atr: return None  # NaN (candle com dado faltando)
     return float(atr)
 
-def price_levels_by_atr(side: str, price: float, atr: float, tp_mult: float, sl_mult: float) -> Tuple[float, float]:
-    if side == "COMPRA":
-        tp = price + tp_mult * atr
-        sl = price - sl_mult * atr
+def _wilder_step(prev_atr: float, row: List[float], prev_close: float, period: int) -> float:
+    h, l = row[2], row[3]
+    tr = max(h - l, abs(h - prev_close), abs(l - prev_close))
+    return (prev_atr * (period - 1) + tr) / period
+
+def atr_incremental(symbol: str, ohlc_raw: List[List[float]], period: int = 14) -> float | None:
+    """
+    ATR de Wilder a partir do estado salvo: só os candles novos passam pela recursão.
+    O último candle (ainda aberto, pode mudar) nunca entra no estado. Sem estado ou com
+    o candle do estado fora da janela: cálculo completo (= compute_atr).
+    Aproximado: depois que a janela desliza, o estado ainda carrega candles que já saíram
+    dela, então o valor difere de compute_atr na ~5ª casa (depende do histórico).
+    A carga completa do OHLC zera o estado (_ohlc_apply), recomeçando do valor exato.
+    """
+    n = len(ohlc_raw)
+    if n < period + 2:
+        return compute_atr(ohlc_raw, period)
+    start = None
+    st = _atr_state.get(symbol)
+    if st is not None:
+        # o candle do estado costuma estar 1-2 posições antes do fim
+        for k in range(n - 2, -1, -1):
+            ts = ohlc_raw[k][0]
+            if ts == st[0]:
+                start = k
+                break
+            if ts < st[0]:
+                break
+    if start is None:
+        atr = compute_atr(ohlc_raw[:-1], period)
+        if atr is None:
+            return None
+        start = n - 2
     else:
-        tp = price - tp_mult * atr
-        sl = price + sl_mult * atr
-    return tp, sl
-
-def enforce_coherence(side: str, entry: float, tp: float, sl: float) -> Tuple[float, float]:
-    if side == "COMPRA":
-        if tp <= entry and sl >= entry: tp, sl = sl, tp
-        if tp <= entry: tp = entry * (1 + max(TP_PCT, 0.001))
-        if sl >= entry: sl = entry * (1 - max(SL_PCT, 0.001))
+        atr = st[1]
+    for k in range(start + 1, n - 1):
+        atr = _wilder_step(atr, ohlc_raw[k], ohlc_raw[k - 1][4], period)
+    _atr_state[symbol] = (ohlc_raw[n - 2][0], atr)
+    return _wilder_step(atr, ohlc_raw[n - 1], ohlc_raw[n - 2][4], period)
+
+MACD_TAIL = 200  # erro da semente SMA cai para ~(25/27)^174 ≈ 1e-6 da EMA26
+
+def symbol_indicators(symbol: str, ohlc_raw: List[List[float]], closes: np.ndarray,
+                      trend: bool = True) -> Dict[str, float | None]:
+    """
+    ATR e, com trend=True, tendência (SMA20/50, MACD) do último candle; recalcula só quando
+    chega candle novo. A tendência só entra no texto do alerta: fica para quando não é duplicado.
+    """
+    tail = tuple(ohlc_raw[-1])
+    hit = _indicators_by_symbol.get(symbol)
+    if hit is not None and hit[0] == tail:
+        ind = hit[1]
     else:
-        if tp >= entry and sl <= entry: tp, sl = sl, tp
-        if tp >= entry: tp = entry * (1 - max(TP_PCT, 0.001))
-        if sl <= entry: sl = entry * (1 + max(SL_PCT, 0.001))
-    return tp, sl
+        ind = {"atr": atr_incremental(symbol, ohlc_raw, ATR_PERIOD) if USE_ATR_LEVELS else None}
+        _indicators_by_symbol[symbol] = (tail, ind)
+    if trend and "sma20" not in ind:
+        # só a cauda: SMA usa os últimos `period` valores; a MACD já convergiu em MACD_TAIL amostras
+        macd_line, macd_sig = macd(closes[-MACD_TAIL:], 12, 26, 9)
+        ind["sma20"] = float(sma(closes[-20:], 20)[-1]) if len(closes) >= 20 else None
+        ind["sma50"] = float(sma(closes[-50:], 50)[-1]) if len(closes) >= 50 else None
+        ind["macd"] = float(macd_line[-1]) if len(macd_line) else None
+        ind["macd_signal"] = float(macd_sig[-1]) if len(macd_sig) else None
+    return ind
+
+def price_levels_batch(sign: np.ndarray, entry: np.ndarray, atr: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    TP/SL/R:R de vários alertas sem if por lado: sign = +1 (COMPRA) / -1 (VENDA).
+    ATR onde há (finito e != 0), senão TP_PCT/SL_PCT; depois a coerência alvo/stop.
+    """
+    use_atr = np.isfinite(atr) & (atr != 0)
+    a = np.where(use_atr, atr, 0.0)
+    tp = np.where(use_atr, entry + sign * TP_ATR_MULT * a, entry * (1 + sign * TP_PCT))
+    sl = np.where(use_atr, entry - sign * SL_ATR_MULT * a, entry * (1 - sign * SL_PCT))
+    # coerência: alvo do lado do lucro, stop do lado da perda
+    swap = (sign * (tp - entry) <= 0) & (sign * (sl - entry) >= 0)
+    tp, sl = np.where(swap, sl, tp), np.where(swap, tp, sl)
+    tp = np.where(sign * (tp - entry) <= 0, entry * (1 + sign * max(TP_PCT, 0.001)), tp)
+    sl = np.where(sign * (sl - entry) >= 0, entry * (1 - sign * max(SL_PCT, 0.001)), sl)
+    rr = sign * (tp - entry) / np.maximum(sign * (entry - sl), 1e-12)
+    return tp, sl, rr
 
 # ----------------- Templates e botões -----------------
 def conf_bar(conf: float, steps: int = 10) -> str:
@@ -232,17 +530,28 @@ def conf_bar(conf: float, steps: int = 10) -> str:
     except Exception:
         return "—"
 
+# NUMBER_FORMAT=comma: troca "," <-> "." numa só passada (tabela montada 1x)
+_FMT_TRANS = str.maketrans({",": ".", ".": ","}) if NUMBER_FORMAT == "comma" else None
+
 def fmtnum(x, decs=4):
     """Formata com PONTO por padrão. Use NUMBER_FORMAT=comma para vírgula."""
     try:
         s = f"{float(x):,.{decs}f}"
-        if NUMBER_FORMAT == "comma":
-            return s.replace(",", "X").replace(".", ",").replace("X", ".")
-        return s  # dot
+        return s.translate(_FMT_TRANS) if _FMT_TRANS else s
     except Exception:
         return str(x)
 
+# teclado é fixo por símbolo (URLs só dependem do símbolo e de APP_BASE_URL): montado 1x
+_keyboard_by_symbol: Dict[str, dict | None] = {}
+_MISSING = object()
+
 def build_inline_keyboard(symbol: str) -> dict | None:
+    kb = _keyboard_by_symbol.get(symbol, _MISSING)
+    if kb is _MISSING:  # None também é resultado válido e fica memoizado
+        kb = _keyboard_by_symbol[symbol] = _build_inline_keyboard(symbol)
+    return kb
+
+def _build_inline_keyboard(symbol: str) -> dict | None:
     kb = []
     tv = f"https://www.tradingview.com/symbols/{symbol.replace('USDT','')}USDT/"
     kb.append([{"text":"📈 TradingView", "url": tv}])
@@ -253,65 +562,75 @@ def build_inline_keyboard(symbol: str) -> dict | None:
         kb.append(kb_row)
     return {"inline_keyboard": kb} if kb else None
 
+# templates das mensagens (montados 1x; preenchidos com format_map só quando o alerta sai)
+_MSG_HEAD = '{side_emoji} <b>{side}</b> | <b>{symbol}</b>\n'
+_MSG_TMPL = {
+    "compact": _MSG_HEAD + (
+        "<pre>"
+        "Entrada  {entry:>12}\n"
+        "Alvo     {tp:>12}\n"
+        "Stop     {sl:>12}\n"
+        "</pre>"
+        "Conf: <code>{conf_pct}%</code> • R:R <code>{rr}</code>\n"
+        "{levels} • {timeframe} • 24h: <code>{pct24:+.2f}%</code>"
+    ),
+    "card": _MSG_HEAD + (
+        "Confiança: <code>{conf_pct}%</code>\n<code>{bar}</code>\n"
+        "<pre>"
+        "Entrada   {entry:>12}\n"
+        "Alvo      {tp:>12}\n"
+        "Stop      {sl:>12}\n"
+        "R:R       {rr:>12}\n"
+        "</pre>"
+        "📊 Tendência: <b>{trend}</b> • "
+        "MACD: <b>{macd_trend}</b> • "
+        "Vol: <b>{volatility}</b>{atr_extra}\n"
+        "🧠 Estratégia: <i>{strat_label}</i> {levels_tag}\n"
+        "⏱️ {timeframe} • 24h: <code>{pct24:+.2f}%</code>"
+    ),
+    "pro": _MSG_HEAD + "\n".join([
+        '🎯 <b>Entrada:</b> <code>{entry}</code>',
+        '🎯 <b>Alvo:</b>    <code>{tp}</code>',
+        '🛑 <b>Stop:</b>    <code>{sl}</code>',
+        '📈 <b>Confiança:</b> <code>{conf_pct}%</code> • <b>R:R</b> <code>{rr}</code>',
+        '🧠 Estratégia: <i>{strat_label}</i> {levels_tag}',
+        '📊 <b>Tendência:</b> {trend} • <b>MACD:</b> {macd_trend} • '
+        '<b>Vol:</b> {volatility}{atr_extra}',
+        '⏱️ {timeframe} • 24h: <code>{pct24:+.2f}%</code>'
+    ]),
+}
+
 def build_msg_html(style: str, symbol: str, side: str, conf: float, content: dict,
                    strat_label: str, timeframe: str, use_atr: bool) -> tuple[str, dict | None]:
-    side_emoji = "🟢" if side == "COMPRA" else "🔴"
     rr_txt = content.get("rr")
     rr_txt = f"{rr_txt:.2f}" if isinstance(rr_txt, (int, float)) else (rr_txt or "—")
-    pct24 = content.get("price_change_24h") or 0.0
     atr_pct = content.get("atr_pct")
     atr_extra = f" ({fmtnum(atr_pct,2).rstrip('0').rstrip('.') }%)" if atr_pct is not None else ""
-    kb = build_inline_keyboard(symbol)
-
-    if style == "compact":
-        head = f'{side_emoji} <b>{html_escape(side)}</b> | <b>{html_escape(symbol)}</b>\n'
-        table = (
-            "<pre>"
-            f"Entrada  {fmtnum(content['entry_price']).rjust(12)}\n"
-            f"Alvo     {fmtnum(content['tp']).rjust(12)}\n"
-            f"Stop     {fmtnum(content['sl']).rjust(12)}\n"
-            "</pre>"
-        )
-        tail = (
-            f"Conf: <code>{int(conf*100)}%</code> • R:R <code>{html_escape(rr_txt)}</code>\n"
-            f"{'ATR' if use_atr else '%'} • {html_escape(timeframe)} • 24h: <code>{pct24:+.2f}%</code>"
-        )
-        return head + table + tail, kb
-
-    if style == "card":
-        bar = conf_bar(conf)
-        head = f'{side_emoji} <b>{html_escape(side)}</b> | <b>{html_escape(symbol)}</b>\n'
-        barline = f"Confiança: <code>{int(conf*100)}%</code>\n<code>{bar}</code>\n"
-        grid = (
-            "<pre>"
-            f"Entrada   {fmtnum(content['entry_price']).rjust(12)}\n"
-            f"Alvo      {fmtnum(content['tp']).rjust(12)}\n"
-            f"Stop      {fmtnum(content['sl']).rjust(12)}\n"
-            f"R:R       {str(rr_txt).rjust(12)}\n"
-            "</pre>"
-        )
-        tech = (
-            f"📊 Tendência: <b>{html_escape(content['trend'])}</b> • "
-            f"MACD: <b>{html_escape(content['macd_trend'])}</b> • "
-            f"Vol: <b>{html_escape(content['volatility'])}</b>{html_escape(atr_extra)}\n"
-            f"🧠 Estratégia: <i>{html_escape(strat_label)}</i> {'(ATR)' if use_atr else '(%)'}\n"
-            f"⏱️ {html_escape(timeframe)} • 24h: <code>{pct24:+.2f}%</code>"
-        )
-        return head + barline + grid + tech, kb
-
-    # default: pro
-    head = f'{side_emoji} <b>{html_escape(side)}</b> | <b>{html_escape(symbol)}</b>\n'
-    lines = [
-        f'🎯 <b>Entrada:</b> <code>{html_escape(fmtnum(content["entry_price"]))}</code>',
-        f'🎯 <b>Alvo:</b>    <code>{html_escape(fmtnum(content["tp"]))}</code>',
-        f'🛑 <b>Stop:</b>    <code>{html_escape(fmtnum(content["sl"]))}</code>',
-        f'📈 <b>Confiança:</b> <code>{int(conf*100)}%</code> • <b>R:R</b> <code>{html_escape(rr_txt)}</code>',
-        f'🧠 Estratégia: <i>{html_escape(strat_label)}</i> {"(ATR)" if use_atr else "(%)"}',
-        f'📊 <b>Tendência:</b> {html_escape(content["trend"])} • <b>MACD:</b> {html_escape(content["macd_trend"])} • '
-        f'<b>Vol:</b> {html_escape(content["volatility"])}{html_escape(atr_extra)}',
-        f'⏱️ {html_escape(timeframe)} • 24h: <code>{pct24:+.2f}%</code>'
-    ]
-    return head + "\n".join(lines), kb
+    values = {
+        "side_emoji": "🟢" if side == "COMPRA" else "🔴",
+        "side": html_const(side),
+        "symbol": html_const(symbol),
+        "entry": html_escape(fmtnum(content["entry_price"])),
+        "tp": html_escape(fmtnum(content["tp"])),
+        "sl": html_escape(fmtnum(content["sl"])),
+        "conf_pct": int(conf*100),
+        "rr": html_escape(rr_txt),
+        "pct24": content.get("price_change_24h") or 0.0,
+        "timeframe": html_const(timeframe),
+        "levels": "ATR" if use_atr else "%",
+        "levels_tag": "(ATR)" if use_atr else "(%)",
+    }
+    tmpl = _MSG_TMPL.get(style, _MSG_TMPL["pro"])
+    if style != "compact":
+        values.update({
+            "bar": conf_bar(conf),
+            "trend": html_const(content["trend"]),
+            "macd_trend": html_const(content["macd_trend"]),
+            "volatility": html_const(content["volatility"]),
+            "atr_extra": html_escape(atr_extra),
+            "strat_label": html_const(strat_label),
+        })
+    return tmpl.format_map(values), build_inline_keyboard(symbol)
 
 # ----------------- IA -----------------
 def load_ai_model():
@@ -319,30 +638,233 @@ def load_ai_model():
     try:
         model, scaler = load_model_and_scaler()
         if model is not None:
-            print("✅ Modelo de IA carregado com sucesso")
+            log.info("✅ Modelo de IA carregado com sucesso")
             return True
-        print("❌ Falha ao carregar modelo de IA")
+        log.error("❌ Falha ao carregar modelo de IA")
         return False
     except Exception as e:
-        print(f"❌ Erro ao carregar modelo: {e}")
+        log.error("❌ Erro ao carregar modelo: %s", e)
         return False
 
 # ----------------- Cache OHLC -----------------
-def get_ohlc_cached(symbol: str, coin_id: str) -> List[List[float]] | None:
-    now = datetime.utcnow()
+def _ohlc_delta_days() -> int:
+    # menor janela com a mesma granularidade do Coingecko: 1-2 dias = 30 min, 3-30 dias = 4 h
+    # (acima de 30 dias o candle é de 4 dias e não existe janela menor equivalente: sem delta)
+    return OHLC_DAYS if OHLC_DAYS <= 2 else min(OHLC_DAYS, 3)
+
+def _merge_ohlc(old: List[List[float]], delta: List[List[float]]) -> List[List[float]]:
+    """Junta o delta ao cache por timestamp (o candle em aberto é substituído) e descarta o que saiu da janela."""
+    by_ts = {row[0]: row for row in old}
+    by_ts.update((row[0], row) for row in delta)
+    merged = [by_ts[ts] for ts in sorted(by_ts)]
+    cutoff = merged[-1][0] - OHLC_DAYS * 86_400_000
+    return [row for row in merged if row[0] >= cutoff]
+
+def _candle_sec() -> int:
+    # duração do candle do Coingecko para OHLC_DAYS: 1-2 dias = 30 min, 3-30 dias = 4 h, 31+ = 4 dias
+    if OHLC_DAYS <= 2:
+        return 1800
+    return 14_400 if OHLC_DAYS <= 30 else 4 * 86_400
+
+def _ohlc_fresh(fetched_at: float, now: float) -> bool:
+    """Dentro do TTL e sem ter virado candle desde a busca (o candle recém-fechado força nova busca)."""
+    period = _candle_sec()
+    return now - fetched_at < OHLC_TTL_SEC and int(now // period) == int(fetched_at // period)
+
+def _ohlc_plan(symbol: str, now: float) -> Tuple[str, List[List[float]] | None]:
+    """O que fazer com o OHLC do símbolo: ("hit", dados) | ("delta", None) | ("full", None)."""
     cached = _ohlc_cache.get(symbol)
-    if cached and (now - cached["ts"]).total_seconds() < OHLC_TTL_SEC:
-        return cached["data"]
-    data = fetch_ohlc(coin_id, days=OHLC_DAYS)
+    if cached and _ohlc_fresh(cached["ts"], now):
+        return "hit", cached["data"]
+    if cached and OHLC_DAYS <= 30 and now - cached["full_ts"] < OHLC_FULL_REFRESH_SEC:
+        # incremental: só os últimos candles, mesma granularidade do cache
+        return "delta", None
+    return "full", None
+
+def _ohlc_days(kind: str) -> int:
+    return _ohlc_delta_days() if kind == "delta" else OHLC_DAYS
+
+def _ohlc_apply(symbol: str, kind: str, data: List[List[float]], now: float) -> List[List[float]] | None:
+    """Grava no cache o que veio da rede; delta vazio => None (quem chamou faz a carga completa)."""
+    if kind == "delta":
+        cached = _ohlc_cache.get(symbol)
+        if not data or not cached:
+            return None
+        data = _merge_ohlc(cached["data"], data)
+        _ohlc_cache[symbol] = {"ts": now, "full_ts": cached["full_ts"], "data": data}
+        return data
     if data:
-        _ohlc_cache[symbol] = {"ts": now, "data": data}
+        _ohlc_cache[symbol] = {"ts": now, "full_ts": now, "data": data}
+        _atr_state.pop(symbol, None)  # janela nova: ATR incremental recomeça do cálculo completo
+        # limite de entradas (símbolos avulsos do /api/test-ai): sai o mais antigo
+        while len(_ohlc_cache) > OHLC_CACHE_MAX:
+            # snapshot: outras threads do pool podem gravar no cache ao mesmo tempo
+            oldest = min(list(_ohlc_cache.items()), key=lambda kv: kv[1]["ts"])[0]
+            _ohlc_cache.pop(oldest, None)
     return data
 
+def get_ohlc_cached(symbol: str, coin_id: str) -> List[List[float]] | None:
+    now = time.time()
+    kind, data = _ohlc_plan(symbol, now)
+    if kind == "hit":
+        return data
+    if kind == "delta":
+        data = _ohlc_apply(symbol, kind, fetch_ohlc(coin_id, days=_ohlc_days(kind)), now)
+        if data:
+            return data
+    return _ohlc_apply(symbol, "full", fetch_ohlc(coin_id, days=OHLC_DAYS), now)
+
+def prefetch_ohlc_async(symbols: List[str]) -> Dict[str, List[List[float]]]:
+    """
+    OHLC dos símbolos com cache vencido em voo ao mesmo tempo (aiohttp, fetch_ohlc_many).
+    Quem falhar fica de fora e cai no caminho síncrono (get_ohlc_cached) em seguida.
+    """
+    now = time.time()
+    out: Dict[str, List[List[float]]] = {}
+    plans: Dict[str, str] = {}
+    for symbol in symbols:
+        kind, data = _ohlc_plan(symbol, now)
+        if kind == "hit":
+            out[symbol] = data
+        else:
+            plans[symbol] = kind
+    if not plans:
+        return out
+    reqs = [(_COIN_IDS.get(sym) or to_cg_id(sym), _ohlc_days(kind)) for sym, kind in plans.items()]
+    for (symbol, kind), res in zip(plans.items(), fetch_ohlc_many(reqs)):
+        if isinstance(res, Exception):
+            log.warning("⚠️ OHLC async falhou para %s: %s", symbol, res)
+            continue
+        data = _ohlc_apply(symbol, kind, res, now)
+        if data:
+            out[symbol] = data
+    return out
+
+def fetch_symbol_ohlc(symbol: str, ohlc_raw: List[List[float]] | None = None) -> List[List[float]] | None:
+    """
+    Parte de rede de um símbolo: OHLC (cacheado). Roda no pool de threads.
+    ohlc_raw já obtido (ex.: prefetch async) dispensa o /ohlc do símbolo.
+    Retorna None se não há candles suficientes para predizer.
+    """
+    if ohlc_raw is None:
+        coin_id = _COIN_IDS.get(symbol) or to_cg_id(symbol)
+        ohlc_raw = get_ohlc_cached(symbol, coin_id)  # cacheado
+    if not ohlc_raw or len(ohlc_raw) < 60:
+        return None
+    return ohlc_raw
+
+def ohlc_matrix(symbol: str, ohlc_raw: List[List[float]]) -> np.ndarray:
+    """
+    OHLC como matriz (n, 5) float64 com ts em segundos. Se ohlc_raw é a lista que está no
+    cache, a conversão fica guardada junto dela (ciclo e /api/test-ai reaproveitam): não alterar.
+    (Sem flag read-only: as assinaturas numba de features.py pedem arrays graváveis.)
+    """
+    entry = _ohlc_cache.get(symbol)
+    if entry is not None and entry["data"] is ohlc_raw:
+        arr = entry.get("arr")
+        if arr is not None:
+            return arr
+    arr = np.asarray(ohlc_raw, dtype=np.float64)
+    arr[:, 0] //= 1000  # ms -> s
+    if entry is not None and entry["data"] is ohlc_raw:
+        entry["arr"] = arr
+    return arr
+
+_NO_CLOSES = np.empty(0)
+
+def process_symbols(symbols: List[str], bulk_data: Dict[str, Dict],
+                    ohlc_by_symbol: Dict[str, List[List[float]]] | None = None) -> List[Tuple[Dict[str, Any] | None, List[List[float]] | None, np.ndarray]]:
+    """
+    OHLC em paralelo (I/O-bound, limitado a OHLC_CONCURRENCY) e depois uma
+    única predição em lote. Não toca no estado de alertas.
+    Retorna (result, ohlc_raw, closes) por símbolo — result=None se não há o que atualizar.
+    """
+    ohlc_by_symbol = ohlc_by_symbol or {}
+    if OHLC_ASYNC and symbols:
+        try:
+            pending = [sym for sym in symbols if sym not in ohlc_by_symbol]
+            ohlc_by_symbol = {**prefetch_ohlc_async(pending), **ohlc_by_symbol}
+        except Exception as e:
+            log.warning("⚠️ OHLC async indisponível, usando threads: %s", e)
+
+    def _fetch(symbol: str):
+        try:
+            return fetch_symbol_ohlc(symbol, ohlc_by_symbol.get(symbol))
+        except Exception as e:
+            log.error("❌ Erro ao processar %s: %s", symbol, e)
+            return None
+
+    if not symbols:
+        return []
+    # acima do pool da sessão, threads extras abririam conexões descartáveis
+    workers = max(1, min(OHLC_CONCURRENCY, POOL_MAXSIZE, len(symbols)))
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        raws = list(ex.map(_fetch, symbols))
+
+    # último candle igual ao do ciclo anterior => predição não muda: reaproveita
+    ready, reused = [], []
+    for i, raw in enumerate(raws):
+        if not raw:
+            continue
+        tail = tuple(raw[-1])
+        if _last_ohlc_tail.get(symbols[i]) == tail and symbols[i] in _prediction_by_symbol:
+            reused.append(i)
+            continue
+        # [ts, o, h, l, c] num único array float64 por símbolo (sem 1 dict por candle)
+        try:
+            ready.append((i, ohlc_matrix(symbols[i], raw)))
+        except Exception as e:
+            # OHLC malformado (linha faltando coluna etc.): só este símbolo fica de fora
+            log.error("❌ OHLC inválido para %s: %s", symbols[i], e)
+    try:
+        predicted = predict_signals([symbols[i] for i, _ in ready], [c for _, c in ready])
+    except Exception as e:
+        # um símbolo ruim não derruba o lote: refaz um a um
+        log.error("❌ Erro na predição em lote, predizendo por símbolo: %s", e)
+        predicted = []
+        for i, candles in ready:
+            try:
+                predicted.append(predict_signal(symbols[i], candles))
+            except Exception as e1:
+                log.error("❌ Erro na predição de %s: %s", symbols[i], e1)
+                predicted.append((None, str(e1)))
+
+    results: Dict[int, Tuple[Dict[str, Any], np.ndarray]] = {}
+    for (i, candles), (result, error) in zip(ready, predicted):
+        if result:
+            _prediction_by_symbol[symbols[i]] = dict(result)
+            _last_ohlc_tail[symbols[i]] = tuple(raws[i][-1])
+            results[i] = (result, np.ascontiguousarray(candles[:, 4]))
+    for i in reused:
+        try:
+            closes = np.ascontiguousarray(ohlc_matrix(symbols[i], raws[i])[:, 4])
+        except Exception as e:
+            log.error("❌ OHLC inválido para %s: %s", symbols[i], e)
+            continue
+        results[i] = (dict(_prediction_by_symbol[symbols[i]]), closes)
+
+    out: List[Tuple[Dict[str, Any] | None, List[List[float]] | None, np.ndarray]] = [(None, None, _NO_CLOSES)] * len(symbols)
+    for i, raw in enumerate(raws):
+        if i not in results:
+            # mantém último no dashboard, mas não atualiza
+            if raw:
+                out[i] = (None, raw, _NO_CLOSES)
+            continue
+        result, closes = results[i]
+        # só preço/variação vêm do bulk a cada ciclo
+        # fetch_bulk_prices já normaliza para float: sem float() por símbolo
+        cur = bulk_data.get(symbols[i], {})
+        result["current_price"] = cur.get("usd", 0.0)
+        result["price_change_24h"] = cur.get("usd_24h_change", 0.0)
+        result["market_cap"] = cur.get("usd_market_cap", 0.0)
+        out[i] = (result, raw, closes)
+    return out
+
 # ----------------- Predição + Alertas -----------------
 def collect_and_predict():
-    global predictions_cache, last_update, _cycle_idx
+    global predictions_cache, last_update, last_update_iso, _pred_snapshot, _cycle_idx
     try:
-        print("🔄 Coletando dados e fazendo predições...")
+        log.info("🔄 Coletando dados e fazendo predições...")
 
         # Preço simples em lote para TODOS (barato e rápido)
         bulk_data = fetch_bulk_prices(SYMBOLS)
@@ -354,180 +876,266 @@ def collect_and_predict():
         end = start + SYMBOLS_PER_CYCLE
         sublist = SYMBOLS[start:end] or SYMBOLS[:SYMBOLS_PER_CYCLE]
         _cycle_idx = (_cycle_idx + 1) % max(1, (len(SYMBOLS) + SYMBOLS_PER_CYCLE - 1)//SYMBOLS_PER_CYCLE)
+        if _cold_skip:
+            # frios ficam no dashboard com a última predição, sem OHLC/predição nesta volta
+            warm = []
+            for sym in sublist:
+                left = _cold_skip.get(sym, 0)
+                if left > 0:
+                    _cold_skip[sym] = left - 1
+                else:
+                    warm.append(sym)
+            sublist = warm
 
         # Mapa atual (preserva últimos resultados dos que não foram analisados neste ciclo)
         cache_map = {p.get("symbol"): p for p in (predictions_cache or [])}
 
         sent_this_cycle: Set[str] = set()
+        alerts: List[Dict[str, Any]] = []  # enviados juntos no fim do ciclo
+
+        # instante único do ciclo (cooldown e timestamp dos alertas)
+        cycle_mono = time.monotonic()
+        cycle_iso = datetime.utcnow().isoformat() + "Z"
+
+        # OHLC + predição da sublista em paralelo; alertas seguem nesta thread
+        processed = process_symbols(sublist, bulk_data)
+
+        # Atualiza cache dos símbolos analisados
+        ready = [(symbol, result, ohlc_raw, closes)
+                 for symbol, (result, ohlc_raw, closes) in zip(sublist, processed) if result]
+        for symbol, result, _, _ in ready:
+            cache_map[symbol] = result
+            if COLD_SKIP_ROUNDS > 0:
+                if (result.get("confidence") or 0.0) < COLD_CONF_MAX:
+                    streak = _cold_streak.get(symbol, 0) + 1
+                    if streak >= COLD_STREAK:
+                        _cold_skip[symbol] = COLD_SKIP_ROUNDS
+                        streak = 0
+                    _cold_streak[symbol] = streak
+                else:
+                    _cold_streak.pop(symbol, None)
+
+        # gatilho de alerta do lote inteiro numa expressão vetorizada;
+        # strings e mensagens só para os símbolos que dispararam
+        # _build_result já entrega float nativo: o cast para float64 fica com o fromiter
+        n_ready = len(ready)
+        conf_arr = np.fromiter((r.get("confidence") or 0.0 for _, r, _, _ in ready), np.float64, n_ready)
+        pb_arr = np.fromiter((r.get("probability_buy") or 0.0 for _, r, _, _ in ready), np.float64, n_ready)
+        ps_arr = np.fromiter((r.get("probability_sell") or 0.0 for _, r, _, _ in ready), np.float64, n_ready)
+        side_codes = np.array([_SIDE_CODES.get(r.get("signal"), -1) for _, r, _, _ in ready], dtype=np.int8)
+        conf_min = ALERT_CONF_MIN
+        mask = (conf_arr >= conf_min) & (
+            ((side_codes == 0) & (pb_arr >= conf_min)) |
+            ((side_codes == 1) & (ps_arr >= conf_min))
+        )
 
-        for symbol in sublist:
+        # candidatos: disparou e está fora do cooldown
+        now = cycle_mono
+        cand: List[int] = []
+        last_sigs: List[Tuple | None] = []  # assinatura anterior de cada candidato (1 lookup só)
+        for idx in np.flatnonzero(mask):
+            if ready[idx][0] in _alert_pending:
+                continue  # alerta anterior ainda na fila do Telegram
+            prev = _alert_state.get(ready[idx][0])
+            if prev is None or (now - prev[0]) >= ALERT_COOLDOWN_SEC:
+                cand.append(int(idx))
+                last_sigs.append(prev[1] if prev is not None else None)
+
+        # níveis de todos os candidatos de uma vez (ATR por símbolo; NaN = usa %)
+        # ATR entra na assinatura (tp/sl) e vem antes do teste de duplicado; vem do cache/estado incremental
+        inds = [symbol_indicators(ready[idx][0], ready[idx][2], ready[idx][3], trend=False) for idx in cand]
+        atrs = np.array([ind["atr"] or np.nan for ind in inds], dtype=np.float64)
+        entries = np.array([ready[idx][1]["current_price"] for idx in cand], dtype=np.float64)
+        signs = np.where(side_codes[cand] == 0, 1.0, -1.0)
+        tps, sls, rrs = price_levels_batch(signs, entries, atrs)
+        # assinatura anti-duplicação em micro-unidades inteiras (exata, sem round() por campo)
+        sig_ticks = np.rint(np.stack([entries, tps, sls], axis=1) * 1e6).astype(np.int64).tolist()
+
+        for j, idx in enumerate(cand):
+            symbol, result, ohlc_raw, closes = ready[idx]
             try:
-                coin_id = SYMBOL_TO_ID.get(symbol, symbol.replace("USDT", "").lower())
-                ohlc_raw = get_ohlc_cached(symbol, coin_id)  # cacheado
-                if not ohlc_raw or len(ohlc_raw) < 60:
-                    # mantém último no dashboard, mas não atualiza
-                    continue
-
-                candles_norm, closes = [], []
-                for ts, o, h, l, c in ohlc_raw:
-                    candles_norm.append({
-                        "timestamp": int(ts/1000),
-                        "open": float(o), "high": float(h),
-                        "low": float(l), "close": float(c)
-                    })
-                    closes.append(float(c))
-
-                result, error = predict_signal(symbol, candles_norm)
-                if not result:
+                if symbol in sent_this_cycle:
                     continue
 
-                cur = bulk_data.get(symbol, {})
-                price_now = float(cur.get("usd", 0.0))
-                pct24 = float(cur.get("usd_24h_change", 0.0))
-                result.update({
-                    "current_price": price_now,
-                    "price_change_24h": pct24,
-                    "market_cap": cur.get("usd_market_cap", 0.0)
-                })
-
-                # Atualiza cache do símbolo
-                cache_map[symbol] = result
-
-                conf = float(result.get("confidence") or 0.0)
-                side = (result.get("signal") or "").upper()
-                prob_buy = float(result.get("probability_buy") or 0.0)
-                prob_sell = float(result.get("probability_sell") or 0.0)
-
-                trigger = (
-                    conf >= ALERT_CONF_MIN and
-                    ((side == "COMPRA" and prob_buy >= ALERT_CONF_MIN) or
-                     (side == "VENDA"  and prob_sell >= ALERT_CONF_MIN))
-                )
-
-                if trigger and symbol not in sent_this_cycle:
-                    now = datetime.utcnow()
-                    last_t = _last_alert_time.get(symbol)
-
-                    entry = price_now
-                    tp, sl = None, None
-                    atr = None
-                    if USE_ATR_LEVELS:
-                        atr = compute_atr(ohlc_raw, ATR_PERIOD)
-                        if atr:
-                            tp, sl = price_levels_by_atr(side, entry, atr, TP_ATR_MULT, SL_ATR_MULT)
-                    if tp is None or sl is None:
-                        if side == "COMPRA":
-                            tp = entry * (1 + TP_PCT); sl = entry * (1 - SL_PCT)
-                        else:
-                            tp = entry * (1 - TP_PCT); sl = entry * (1 + SL_PCT)
-
-                    tp, sl = enforce_coherence(side, entry, tp, sl)
-
-                    if side == "COMPRA":
-                        rr = (tp - entry) / max(entry - sl, 1e-12)
-                    else:
-                        rr = (entry - tp) / max(sl - entry, 1e-12)
-
-                    sig = (side, round(entry,6), round(tp,6), round(sl,6))
-                    last_sig = _last_alert_sig.get(symbol)
-                    cooldown_ok = (not last_t) or ((now - last_t) >= timedelta(minutes=ALERT_COOLDOWN_MIN))
-                    is_dup = (last_sig == sig)
-                    if cooldown_ok and not is_dup:
-                        _last_alert_sig[symbol] = sig
-                        sent_this_cycle.add(symbol)
-
-                        trend_txt = "Neutra"
-                        vol_txt = "—"
-                        atr_pct = None
-                        if atr and entry > 0:
-                            atr_pct = (atr / entry) * 100.0
-                            if atr_pct < 1.5: vol_txt = "Baixa"
-                            elif atr_pct < 3.0: vol_txt = "Média"
-                            else: vol_txt = "Alta"
-
-                        def _sma(vals, n):
-                            return sma(vals, n)[-1] if len(vals) >= n else None
-
-                        sma20_last = _sma(closes, 20)
-                        sma50_last = _sma(closes, 50)
-                        macd_line, macd_sig = macd(closes, 12, 26, 9)
-                        if sma20_last is not None and sma50_last is not None:
-                            if sma20_last > sma50_last: trend_txt = "Alta"
-                            elif sma20_last < sma50_last: trend_txt = "Baixa"
-                        macd_txt = "—"
-                        if macd_line and macd_sig:
-                            macd_txt = "Alta" if macd_line[-1] > macd_sig[-1] else "Baixa"
-
-                        content = {
-                            "symbol": symbol,
-                            "side": side,
-                            "strategy": STRATEGY_LABEL,
-                            "timeframe": TIMEFRAME,
-                            "entry": round(entry, 6),
-                            "entry_price": round(entry, 6),
-                            "target_price": round(tp, 6),
-                            "tp": round(tp, 6),
-                            "stop_loss": round(sl, 6),
-                            "sl": round(sl, 6),
-                            "current_price": round(price_now, 6),
-                            "confidence": conf,
-                            "probability_buy": prob_buy,
-                            "probability_sell": prob_sell,
-                            "price_change_24h": pct24,
-                            "rr": round(rr, 2),
-                            "atr": round(atr, 6) if atr else None,
-                            "atr_pct": round(atr_pct, 2) if atr_pct else None,
-                            "trend": trend_txt,
-                            "macd_trend": macd_txt,
-                            "volatility": vol_txt,
-                            "timestamp": now.isoformat() + "Z"
-                        }
-
-                        txt, kb = build_msg_html(ALERT_TEMPLATE, symbol, side, conf, content, STRATEGY_LABEL, TIMEFRAME, USE_ATR_LEVELS)
-                        notify_telegram_message(txt, payload=content, parse_mode="HTML", reply_markup=kb)
-                        _last_alert_time[symbol] = now
-
-                # pausa anti-burst entre símbolos
-                time.sleep(INTER_SYMBOL_SLEEP)
+                price_now = result["current_price"]
+                pct24 = result["price_change_24h"]
+                conf = float(conf_arr[idx])
+                side = _SIDES[side_codes[idx]]
+                prob_buy = float(pb_arr[idx])
+                prob_sell = float(ps_arr[idx])
+
+                entry = price_now
+                atr = None if np.isnan(atrs[j]) else float(atrs[j])
+                tp, sl, rr = float(tps[j]), float(sls[j]), float(rrs[j])
+
+                sig = (int(side_codes[idx]), *sig_ticks[j])
+                is_dup = (last_sigs[j] == sig)
+                if not is_dup:
+                    sent_this_cycle.add(symbol)
+
+                    trend_txt = "Neutra"
+                    vol_txt = "—"
+                    atr_pct = None
+                    if atr and entry > 0:
+                        atr_pct = (atr / entry) * 100.0
+                        if atr_pct < 1.5: vol_txt = "Baixa"
+                        elif atr_pct < 3.0: vol_txt = "Média"
+                        else: vol_txt = "Alta"
+
+                    ind = symbol_indicators(symbol, ohlc_raw, closes)
+                    sma20_last, sma50_last = ind["sma20"], ind["sma50"]
+                    if sma20_last is not None and sma50_last is not None:
+                        if sma20_last > sma50_last: trend_txt = "Alta"
+                        elif sma20_last < sma50_last: trend_txt = "Baixa"
+                    macd_txt = "—"
+                    if ind["macd"] is not None and ind["macd_signal"] is not None:
+                        macd_txt = "Alta" if ind["macd"] > ind["macd_signal"] else "Baixa"
+
+                    content = {
+                        "symbol": symbol,
+                        "side": side,
+                        "strategy": STRATEGY_LABEL,
+                        "timeframe": TIMEFRAME,
+                        "entry": round(entry, 6),
+                        "entry_price": round(entry, 6),
+                        "target_price": round(tp, 6),
+                        "tp": round(tp, 6),
+                        "stop_loss": round(sl, 6),
+                        "sl": round(sl, 6),
+                        "current_price": round(price_now, 6),
+                        "confidence": conf,
+                        "probability_buy": prob_buy,
+                        "probability_sell": prob_sell,
+                        "price_change_24h": pct24,
+                        "rr": round(rr, 2),
+                        "atr": round(atr, 6) if atr else None,
+                        "atr_pct": round(atr_pct, 2) if atr_pct else None,
+                        "trend": trend_txt,
+                        "macd_trend": macd_txt,
+                        "volatility": vol_txt,
+                        "timestamp": cycle_iso
+                    }
+
+                    txt, kb = build_msg_html(ALERT_TEMPLATE, symbol, side, conf, content, STRATEGY_LABEL, TIMEFRAME, USE_ATR_LEVELS)
+                    alerts.append({"symbol": symbol, "sig": sig, "text": txt, "kb": kb, "content": content})
 
             except Exception as e:
-                print(f"❌ Erro ao processar {symbol}: {e}")
+                log.error("❌ Erro ao processar %s: %s", symbol, e)
                 continue
 
+        send_alerts(alerts, cycle_mono)
+
+        # esquece alertas bem mais velhos que o cooldown (não bloqueiam mais nada)
+        stale_after = 10 * ALERT_COOLDOWN_SEC
+        for sym, st in list(_alert_state.items()):
+            if cycle_mono - st[0] > stale_after and _alert_state.get(sym) is st:
+                del _alert_state[sym]
+
         # reconstrói predictions_cache preservando todos os símbolos já vistos
-        new_list: List[Dict[str, Any]] = []
-        for sym in SYMBOLS:
+        new_list: List[Dict[str, Any]] = [None] * len(SYMBOLS)  # tamanho fixo: sem realocações
+        for k, sym in enumerate(SYMBOLS):
             if sym in cache_map:
-                new_list.append(cache_map[sym])
+                new_list[k] = cache_map[sym]
             else:
-                # se nunca vimos, cria stub com preço atual (para não "sumir" do dashboard)
+                # se nunca vimos, usa um stub com preço atual (para não "sumir" do dashboard);
+                # dict novo por ciclo: o snapshot publicado ainda referencia o anterior
                 cur = bulk_data.get(sym, {})
-                new_list.append({
-                    "symbol": sym,
-                    "current_price": float(cur.get("usd", 0.0)),
-                    "price_change_24h": float(cur.get("usd_24h_change", 0.0)),
-                    "signal": None, "confidence": 0.0
-                })
+                new_list[k] = {"symbol": sym, "signal": None, "confidence": 0.0,
+                               "current_price": cur.get("usd", 0.0),
+                               "price_change_24h": cur.get("usd_24h_change", 0.0)}
 
         predictions_cache = new_list
         last_update = datetime.utcnow()
-        print(f"✅ Predições atualizadas (sublista {len(sublist)}/{len(SYMBOLS)}). Total em cache: {len(predictions_cache)}")
+        last_update_iso = last_update.isoformat()
+        # corpo de /api/predictions serializado uma vez por ciclo
+        payload = {
+            "success": True,
+            "predictions": new_list,
+            "last_update": last_update_iso,
+            "total_signals": len(new_list),
+            "alert_template": ALERT_TEMPLATE,
+            "alert_mode": ALERT_MODE,
+            "stale": False
+        }
+        blob = orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+        _pred_snapshot = (payload, blob, gzip.compress(blob, compresslevel=6),
+                          hashlib.blake2b(blob, digest_size=8).hexdigest(), time.monotonic())
+        if _redis is not None:
+            try:
+                _redis.set(_REDIS_PRED_KEY, blob, ex=int(PREDICTIONS_STALE_SEC))
+            except Exception as e:
+                log.warning("⚠️ Redis: falha ao publicar predições: %s", e)
+        _first_refresh.set()
+        log.info("✅ Predições atualizadas (sublista %s/%s). Total em cache: %s", len(sublist), len(SYMBOLS), len(predictions_cache))
 
+    except Exception:
+        log.exception("❌ Erro na coleta/predição")
+
+def _claim_updater() -> bool:
+    """
+    Com Redis, só o worker dono do lock roda o ciclo (lock renovado a cada volta;
+    se o dono morre, outro assume quando o TTL expira). Sem Redis, sempre True.
+    """
+    global _is_owner
+    if _redis is None:
+        return True
+    was_owner = _is_owner
+    token = f"{_PROCESS_TAG}:{os.getpid()}"
+    ttl = int(2 * UPDATE_INTERVAL_SEC + 60)
+    try:
+        if _redis.set(_REDIS_LOCK_KEY, token, nx=True, ex=ttl):
+            _is_owner = True
+        else:
+            _is_owner = bool(_renew_lock(keys=[_REDIS_LOCK_KEY], args=[token, ttl]))
     except Exception as e:
-        print(f"❌ Erro na coleta/predição: {e}")
+        # sem Redis não dá para saber quem é o dono: não roda (evita alertas duplicados)
+        log.warning("⚠️ Redis lock erro: %s", e)
+        _is_owner = False
+    if _is_owner and not was_owner:
+        _restore_alerts()  # assumiu o ciclo: herda os cooldowns do dono anterior
+    return _is_owner
 
 def background_updater():
+    """Único dono do ciclo: roda a cada UPDATE_INTERVAL_SEC ou quando há pedido na fila."""
+    waiters: List[_UpdateRequest] = []
+    # prazo em relógio monotônico: a duração do ciclo não empurra o próximo
+    next_t = time.monotonic()
     while True:
         try:
-            collect_and_predict()
-        except Exception as e:
-            print(f"❌ Erro no updater: {e}")
-        time.sleep(UPDATE_INTERVAL_SEC)
+            ran = _claim_updater()
+        except Exception:
+            # nunca derruba a thread do updater: tenta de novo na próxima volta
+            log.exception("❌ Erro ao disputar o lock do updater")
+            ran = False
+        if ran:
+            _update_in_flight.set()
+            try:
+                collect_and_predict()
+            except Exception:
+                log.exception("❌ Erro no updater")
+            finally:
+                _update_in_flight.clear()
+        for ev in waiters:
+            ev.ran = ran
+            ev.set()
+        waiters = []
+        next_t += UPDATE_INTERVAL_SEC
+        now = time.monotonic()
+        if next_t < now:
+            next_t = now  # ciclo estourou o intervalo: segue sem acumular atraso
+        try:
+            waiters.append(_update_requests.get(timeout=next_t - now))
+            # pedidos acumulados durante o ciclo viram uma única atualização
+            while True:
+                waiters.append(_update_requests.get_nowait())
+        except queue.Empty:
+            pass
+        if waiters:
+            next_t = time.monotonic()  # atualização forçada reinicia a contagem
 
 # ----------------- Views -----------------
-@app.route("/")
-def index():
-    html = r"""
+# dashboard estático (sem Jinja): montado uma vez no import
+_INDEX_HTML = r"""
 <!doctype html>
 <html lang="pt-br">
 <head>
@@ -635,30 +1243,91 @@ pullStatus(); pull(); setInterval(()=>{ pullStatus(); pull(); }, 60000);
 </script>
 </body>
 </html>
-"""
-    return render_template_string(html)
+""".encode("utf-8")
+_INDEX_HTML_GZ = gzip.compress(_INDEX_HTML, compresslevel=9)
+_INDEX_ETAG = hashlib.blake2b(_INDEX_HTML, digest_size=8).hexdigest()
+
+def _precompressed(raw: bytes, gz: bytes, mimetype: str) -> Response:
+    """Serve a versão gzip pronta quando o cliente aceita (sem comprimir por request)."""
+    if gz and "gzip" in request.headers.get("Accept-Encoding", ""):
+        resp = Response(gz, mimetype=mimetype)
+        resp.headers["Content-Encoding"] = "gzip"
+    else:
+        resp = Response(raw, mimetype=mimetype)
+    resp.headers["Vary"] = "Accept-Encoding"
+    return resp
+
+@app.route("/")
+def index():
+    # revalidação depois do max-age: mesmo HTML => 304 sem corpo
+    if request.if_none_match.contains_weak(_INDEX_ETAG):
+        resp = Response(status=304)
+    else:
+        resp = _precompressed(_INDEX_HTML, _INDEX_HTML_GZ, "text/html")
+    resp.set_etag(_INDEX_ETAG, weak=True)
+    # HTML estático (os dados vêm por /api/*): o navegador pode reaproveitar
+    resp.headers["Cache-Control"] = "public, max-age=300"
+    return resp
 
 # ----------------- API: dados -----------------
+def _j(payload: Dict[str, Any], status: int = 200) -> Response:
+    """Resposta JSON via orjson (bytes direto, sem passar pelo json da stdlib)."""
+    return Response(orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY), status=status, mimetype="application/json")
+
+def _stream_predictions(payload: Dict[str, Any], chunk: int = 20):
+    """JSON de /api/predictions em pedaços (orjson por lote de 20), sem montar o corpo inteiro."""
+    preds = payload.get("predictions") or []
+    head = orjson.dumps({k: v for k, v in payload.items() if k != "predictions"})
+    yield head[:-1] + b',"predictions":['
+    for i in range(0, len(preds), chunk):
+        if i:
+            yield b","
+        yield orjson.dumps(preds[i:i + chunk], option=orjson.OPT_SERIALIZE_NUMPY)[1:-1]
+    yield b"]}"
+
 @app.route("/api/predictions")
 def get_predictions():
-    global predictions_cache, last_update
-    if not predictions_cache or not last_update or (datetime.utcnow() - last_update).seconds > UPDATE_INTERVAL_SEC:
-        collect_and_predict()
-    return jsonify({
-        "success": True,
-        "predictions": predictions_cache,
-        "last_update": last_update.isoformat() if last_update else None,
-        "total_signals": len(predictions_cache),
-        "alert_template": ALERT_TEMPLATE,
-        "alert_mode": ALERT_MODE
-    })
+    # somente leitura: quem atualiza é o background_updater
+    if not _is_owner:
+        # outro worker roda o ciclo: serve o JSON que ele publicou no Redis
+        try:
+            blob = _redis.get(_REDIS_PRED_KEY)
+            if blob:
+                return Response(blob, mimetype="application/json")
+        except Exception as e:
+            log.warning("⚠️ Redis: falha ao ler predições: %s", e)
+        if not _first_refresh.is_set():
+            # nada publicado no Redis e nada local: não adianta esperar (202) neste worker
+            return _j({"success": False, "ready": False, "error": "Nenhuma predição publicada pelo worker dono",
+                       "updater_owner": False, "predictions": [], "last_update": None}, 503)
+    if not _first_refresh.is_set():
+        return _j({"success": False, "ready": False, "predictions": [], "last_update": None}, 202)
+    payload, blob, blob_gz, etag, updated = _pred_snapshot  # uma leitura, estado coerente
+    if time.monotonic() - updated < PREDICTIONS_STALE_SEC:
+        # ETag fraca: vale para a versão gzip e a sem compressão
+        if request.if_none_match.contains_weak(etag):
+            resp = Response(status=304)
+        else:
+            resp = _precompressed(blob, blob_gz, "application/json")
+        resp.set_etag(etag, weak=True)
+        return resp
+    # velho: serve o cache mesmo assim e pede um ciclo (sem esperar por ele)
+    if not _update_in_flight.is_set() and _update_requests.empty():
+        _update_requests.put(_UpdateRequest())
+    payload = {**payload, "stale": True}
+    if len(payload.get("predictions") or []) >= PREDICTIONS_STREAM_MIN:
+        resp = Response(stream_with_context(_stream_predictions(payload)), mimetype="application/json")
+    else:
+        resp = _j(payload)
+    resp.headers["X-Stale"] = "1"
+    return resp
 
 @app.route("/api/status")
 def get_status():
-    return jsonify({
+    return _j({
         "status": "online",
         "model_loaded": model is not None,
-        "last_update": last_update.isoformat() if last_update else None,
+        "last_update": last_update_iso,
         "cached_predictions": len(predictions_cache),
         "alert_conf_min": ALERT_CONF_MIN,
         "alert_cooldown_min": ALERT_COOLDOWN_MIN,
@@ -672,16 +1341,43 @@ def get_status():
         "symbols_per_cycle": SYMBOLS_PER_CYCLE,
         "ohlc_days": OHLC_DAYS,
         "ohlc_ttl_sec": OHLC_TTL_SEC,
-        "inter_symbol_sleep": INTER_SYMBOL_SLEEP
+        "ohlc_cache_max": OHLC_CACHE_MAX,
+        "ohlc_full_refresh_sec": OHLC_FULL_REFRESH_SEC,
+        "coingecko_rate_per_min": COINGECKO_RATE_PER_MIN,
+        "inter_symbol_sleep": 0.0,  # compat: pausa fixa substituída pelo rate limit acima
+        "ohlc_concurrency": OHLC_CONCURRENCY,
+        "use_sparkline": USE_SPARKLINE,
+        "ohlc_async": OHLC_ASYNC,
+        "redis": _redis is not None,
+        "updater_owner": _is_owner
     })
 
 @app.route("/api/force-update")
 def force_update():
     try:
-        collect_and_predict()
-        return jsonify({"success": True, "message": "Predições atualizadas", "count": len(predictions_cache)})
+        if not _is_owner:
+            # com Redis só o worker dono roda o ciclo: limpar cache/enfileirar aqui não teria efeito
+            try:
+                has_owner = _redis.get(_REDIS_LOCK_KEY) is not None
+            except Exception as e:
+                log.warning("⚠️ Redis: falha ao ler lock: %s", e)
+                has_owner = False
+            if not has_owner:
+                return _j({"success": False, "error": "Nenhum worker roda o ciclo no momento", "updater_owner": False}, 503)
+            return _j({"success": False, "error": "Este worker não roda o ciclo; tente de novo", "updater_owner": False}, 409)
+        # preços frescos; OHLC segue o TTL normal (endpoint público: não força recarga no Coingecko)
+        clear_price_cache()
+        done = _UpdateRequest()
+        _update_requests.put(done)
+        # ?wait=1 espera o ciclo (até FORCE_UPDATE_WAIT_SEC) sem rodá-lo nesta thread
+        if request.args.get("wait") in {"1", "true", "yes"} and done.wait(timeout=FORCE_UPDATE_WAIT_SEC):
+            if not done.ran:
+                # perdeu o lock entre o pedido e o ciclo: nada rodou aqui
+                return _j({"success": False, "error": "Este worker não roda o ciclo; tente de novo", "updater_owner": False}, 409)
+            return _j({"success": True, "message": "Predições atualizadas", "count": len(predictions_cache)})
+        return _j({"success": True, "message": "Atualização agendada", "count": len(predictions_cache)}, 202)
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+        return _j({"success": False, "error": str(e)}, 500)
 
 @app.route("/api/test-ai")
 def test_ai():
@@ -689,24 +1385,20 @@ def test_ai():
         symbol = (request.args.get("symbol") or "BTCUSDT").upper().strip()
         days = int(request.args.get("days") or OHLC_DAYS)
 
-        coin_id = SYMBOL_TO_ID.get(symbol, symbol.replace("USDT", "").lower())
-        ohlc_raw = get_ohlc_cached(symbol, coin_id)
+        ohlc_raw = get_ohlc_cached(symbol, to_cg_id(symbol))
         if not ohlc_raw or len(ohlc_raw) < 20:
-            return jsonify({"success": False, "error": f"OHLC insuficiente para {symbol} (days={days})", "symbol": symbol}), 400
-
-        candles = []
-        for ts, o, h, l, c in ohlc_raw:
-            candles.append({
-                "timestamp": int(ts/1000),
-                "open": float(o), "high": float(h),
-                "low": float(l), "close": float(c)
-            })
-
-        result, error = predict_signal(symbol, candles)
-        price_ctx = fetch_bulk_prices([symbol]).get(symbol, {})
+            return _j({"success": False, "error": f"OHLC insuficiente para {symbol} (days={days})", "symbol": symbol}, 400)
+
+        if _last_ohlc_tail.get(symbol) == tuple(ohlc_raw[-1]) and symbol in _prediction_by_symbol:
+            # mesmo candle do último ciclo: a predição já está pronta
+            result, error = dict(_prediction_by_symbol[symbol]), None
+        else:
+            result, error = predict_signal(symbol, ohlc_matrix(symbol, ohlc_raw))
+        # mesma lista do ciclo => mesma chave no cache de preços (TTL 60s), sem ir à rede
+        price_ctx = fetch_bulk_prices(SYMBOLS if symbol in _COIN_IDS else [symbol]).get(symbol, {})
         now_iso = datetime.utcnow().isoformat() + "Z"
 
-        return jsonify({
+        return _j({
             "success": True if result else False,
             "model_loaded": (model is not None),
             "symbol": symbol,
@@ -719,29 +1411,37 @@ def test_ai():
                 "price_change_24h": price_ctx.get("usd_24hr_change") or price_ctx.get("usd_24h_change"),
                 "market_cap": price_ctx.get("usd_market_cap")
             }
-        }), (200 if result else 500)
+        }, 200 if result else 500)
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+        return _j({"success": False, "error": str(e)}, 500)
 
 @app.route("/health")
 def health():
-    return jsonify(ok=True, model_loaded=(model is not None)), 200
+    return _j({"ok": True, "model_loaded": model is not None})
 
 # ----------------- Boot (não bloqueante) -----------------
-if __name__ == "__main__":
-    print("🚀 Iniciando Crypto Trading API...")
+_started = False
+_started_lock = threading.Lock()
+
+def start_background():
+    """Carrega o modelo e sobe o background_updater (uma vez por processo; ver wsgi.py)."""
+    global _started
+    with _started_lock:
+        if _started:
+            return
+        _started = True
+    log.info("🚀 Iniciando Crypto Trading API...")
     load_ai_model()
 
-    def _kickoff_first_cycle():
-        try:
-            collect_and_predict()
-        except Exception as e:
-            print(f"❌ Erro no primeiro ciclo: {e}")
-
+    threading.Thread(target=_tg_worker, daemon=True).start()
+    # o updater já roda o primeiro ciclo ao iniciar
     threading.Thread(target=background_updater, daemon=True).start()
-    threading.Thread(target=_kickoff_first_cycle, daemon=True).start()
 
-    print("✅ API iniciada com sucesso!")
+    log.info("✅ API iniciada com sucesso!")
+
+if __name__ == "__main__":
+    # servidor de desenvolvimento; em produção: gunicorn wsgi:app (Procfile)
+    start_background()
     port = int(os.environ.get("PORT", 8080))
-    print(f"🌐 Acesse: http://0.0.0.0:{port}")
+    log.info("🌐 Acesse: http://0.0.0.0:%s", port)
     app.run(host="0.0.0.0", port=port, debug=False, threaded=True)
@@ -6,6 +6,9 @@ from datetime import datetime, timedelta
 # URL base da NewsAPI
 NEWS_API_URL = "https://newsapi.org/v2/everything"
 
+# Sessão reaproveitada entre símbolos (keep-alive, sem novo handshake TLS a cada busca)
+_session = requests.Session()
+
 def get_recent_news(symbol):
     """Busca as notícias mais recentes para um símbolo usando a NewsAPI."""
     
@@ -34,7 +37,7 @@ def get_recent_news(symbol):
     }
     
     try:
-        response = requests.get(NEWS_API_URL, params=params)
+        response = _session.get(NEWS_API_URL, params=params, timeout=15)
         response.raise_for_status()
         data = response.json()
         
@@ -6,48 +6,160 @@ Usa TELEGRAM_BOT_TOKEN e TELEGRAM_CHAT_ID do ambiente.
 """
 
 import os
-import json
+import re
+import time
+import random
+import logging
+import functools
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
-CHAT_ID   = os.environ.get("TELEGRAM_CHAT_ID")
+log = logging.getLogger("telegram")
 
-API_URL = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage" if BOT_TOKEN else None
+# keep-alive: um handshake TLS por processo, não por mensagem.
+# Retry só em falha de conexão (POST fora de allowed_methods: nada é reenviado em dobro).
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                                       max_retries=Retry(total=3, backoff_factor=0.3)))
 
-def _ensure_env():
-    if not BOT_TOKEN or not CHAT_ID:
+@functools.lru_cache(maxsize=1)
+def _resolve_env():
+    """
+    (token, chat_id, url) lidos do ambiente no primeiro envio, não no import
+    (funciona com load_dotenv tardio). Erro não fica em cache: tenta de novo na próxima.
+    """
+    token = os.environ.get("TELEGRAM_BOT_TOKEN")
+    chat_id = os.environ.get("TELEGRAM_CHAT_ID")
+    if not token or not chat_id:
         raise RuntimeError("TELEGRAM_BOT_TOKEN ou TELEGRAM_CHAT_ID não definidos no ambiente.")
+    return token, chat_id, f"https://api.telegram.org/bot{token}/sendMessage"
+
+# retry com backoff exponencial + jitter só para falhas transitórias (429/5xx, conexão)
+MAX_RETRIES = max(0, int(os.environ.get("TELEGRAM_MAX_RETRIES", 3)))  # reenvios além da 1ª tentativa
+BASE_DELAY = 1.0
+MAX_DELAY = 30.0
+_RETRY_STATUS = frozenset((429, 500, 502, 503, 504))
+_JSON_HDR = {"Content-Type": "application/json"}
 
 def _post(data: dict, timeout: int = 12):
-    resp = requests.post(API_URL, json=data, timeout=timeout)
-    try:
-        js = resp.json()
-    except Exception:
-        js = {"ok": False, "text": resp.text}
-    ok = (resp.status_code == 200) and bool(js.get("ok"))
-    print(f"[TG] tentativa 1, status={resp.status_code}, resp={json.dumps(js)[:200]}")
-    return ok, js
+    api_url = _resolve_env()[2]
+    js: dict = {"ok": False}
+    body = orjson.dumps(data)  # serializado 1x, reaproveitado nas tentativas
+    attempts = MAX_RETRIES + 1
+    for attempt in range(1, attempts + 1):
+        delay = min(MAX_DELAY, BASE_DELAY * 2 ** (attempt - 1) * (1 + random.random() * 0.5))
+        try:
+            resp = _session.post(api_url, data=body, headers=_JSON_HDR, timeout=timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout) as e:
+            # ReadTimeout fica de fora: a mensagem pode ter sido entregue (reenviar duplicaria)
+            js = {"ok": False, "text": str(e)}
+            log.warning("[TG] tentativa %s, erro de conexão: %s", attempt, e)
+        else:
+            try:
+                js = resp.json()
+            except Exception:
+                js = {"ok": False, "text": resp.text}
+            ok = (resp.status_code == 200) and bool(js.get("ok"))
+            if log.isEnabledFor(logging.INFO):
+                log.info("[TG] tentativa %s, status=%s resp=%.200s", attempt, resp.status_code, resp.text)
+            if ok or resp.status_code not in _RETRY_STATUS:
+                return ok, js  # sucesso ou erro permanente (4xx)
+            if resp.status_code == 429:
+                # flood control: espera o que o Telegram pedir (corpo ou header)
+                ra = (js.get("parameters") or {}).get("retry_after") or resp.headers.get("Retry-After")
+                try:
+                    delay = float(ra)
+                except (TypeError, ValueError):
+                    pass
+        if attempt < attempts:
+            time.sleep(delay)
+    return False, js
+
+# limite do sendMessage (acima disso o Telegram responde 400 sem enviar)
+TG_MAX_LEN = 4096
+_CHUNK_LEN = 4000
+
+# átomos indivisíveis: tag HTML, entidade (&amp;), quebra de parágrafo/linha, 1 caractere
+_HTML_ATOM = re.compile(r"<[^<>]*>|&#?\w+;|\n\n|\n|[^\n]", re.S)
+_TEXT_ATOM = re.compile(r"\n\n|\n|[^\n]", re.S)
+_TAG = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^<>]*?(/?)>")
+
+def _tg_len(text: str) -> int:
+    """Tamanho como o Telegram conta: unidades UTF-16, não caracteres Python."""
+    return len(text.encode("utf-16-le")) // 2
+
+def _closing(stack: list) -> str:
+    return "".join(f"</{name}>" for name, _ in reversed(stack))
+
+def _split_text(text: str, html: bool = True) -> list[str]:
+    """
+    Quebra em mensagens de até _CHUNK_LEN (unidades UTF-16), preferindo fim de
+    parágrafo ("\n\n"), depois fim de linha; corte no meio da linha só se não houver outro jeito.
+    Em HTML nunca corta dentro de tag/entidade e fecha/reabre as tags abertas no corte
+    (um <pre> longo vira '<pre>…</pre>' + '<pre>…</pre>', ambos válidos).
+    """
+    atoms = (_HTML_ATOM if html else _TEXT_ATOM).findall(text)
+    chunks: list[str] = []
+    stack: list = []  # tags abertas: (nome, tag de abertura original)
+    i = 0
+    while i < len(atoms):
+        parts = [t for _, t in stack]  # reabre o que ficou aberto no corte anterior
+        size = sum(_tg_len(t) for t in parts)
+        st = list(stack)
+        breaks: dict = {}  # "\n\n"/"\n" -> (próximo átomo, pilha, nº de partes) no último ponto desse tipo
+        j = i
+        while j < len(atoms):
+            a = atoms[j]
+            n = _tg_len(a)
+            if j > i and size + n + _tg_len(_closing(st)) > _CHUNK_LEN:
+                break
+            parts.append(a)
+            size += n
+            j += 1
+            m = _TAG.fullmatch(a) if html and a[0] == "<" else None
+            if m and not m.group(3):
+                if m.group(1):
+                    for k in range(len(st) - 1, -1, -1):
+                        if st[k][0] == m.group(2).lower():
+                            del st[k:]
+                            break
+                else:
+                    st.append((m.group(2).lower(), a))
+            if a in ("\n\n", "\n"):
+                breaks[a] = (j, list(st), len(parts))
+        if j < len(atoms):
+            j, st, k = breaks.get("\n\n") or breaks.get("\n") or (j, st, len(parts))
+            parts = parts[:k]
+        chunk = "".join(parts).rstrip("\n") + _closing(st)
+        if chunk.strip():
+            chunks.append(chunk)
+        i, stack = j, st
+    return chunks
 
 def notify_telegram(text: str, parse_mode: str = "HTML", reply_markup: dict | None = None):
     """Envio simples direto por texto (compat)."""
-    _ensure_env()
-    data = {"chat_id": CHAT_ID, "text": text, "parse_mode": parse_mode}
-    if reply_markup:
-        data["reply_markup"] = reply_markup
-    ok, _ = _post(data)
-    return ok
+    return send_signal_notification({"text": text, "parse_mode": parse_mode, "reply_markup": reply_markup})
 
 def send_signal_notification(payload: dict):
     """
     API preferida pelo main.py.
     Aceita: {"text": "...", "parse_mode": "HTML", "reply_markup": {...}}
     """
-    _ensure_env()
+    chat_id = _resolve_env()[1]
     text = payload.get("text") or payload.get("message") or ""
     parse_mode = payload.get("parse_mode", "HTML")
     reply_markup = payload.get("reply_markup")
-    data = {"chat_id": CHAT_ID, "text": text, "parse_mode": parse_mode}
-    if reply_markup:
-        data["reply_markup"] = reply_markup
-    ok, _ = _post(data)
-    return ok
+    if _tg_len(text) <= TG_MAX_LEN:
+        parts = [text]
+    else:
+        parts = _split_text(text, html=str(parse_mode).upper() == "HTML")
+    oks = []
+    for i, part in enumerate(parts):
+        data = {"chat_id": chat_id, "text": part, "parse_mode": parse_mode}
+        if reply_markup and i == len(parts) - 1:  # teclado só na última parte
+            data["reply_markup"] = reply_markup
+        ok, _ = _post(data)
+        oks.append(ok)
+    return all(oks)
@@ -2,13 +2,16 @@
 """
 Script para fazer predições usando o modelo treinado
 """
-import os, json, joblib, numpy as np
+import os, json, joblib, threading, numpy as np
 from datetime import datetime
 from indicators import rsi, macd, ema, bollinger
+from features import compute_features, batch_compute_features, stack_ohlc
 import pandas as pd
 
 MODEL_FILE = "model_enhanced.pkl"
 SCALER_FILE = "scaler.pkl"
+# threads nativas do modelo (XGBoost/RandomForest) na predição em lote; vazio = o que veio do treino
+MODEL_N_JOBS = os.environ.get("MODEL_N_JOBS")
 
 def load_model_and_scaler():
     """Carrega modelo e scaler treinados"""
@@ -17,17 +20,44 @@ def load_model_and_scaler():
     
     model = joblib.load(MODEL_FILE)
     scaler = joblib.load(SCALER_FILE)
+    if MODEL_N_JOBS and "n_jobs" in getattr(model, "get_params", dict)():
+        # paralelismo dentro de uma chamada predict (fora do GIL), sem processos extras
+        model.set_params(n_jobs=int(MODEL_N_JOBS))
     return model, scaler
 
+# modelo/scaler carregados uma vez por processo (predict_signal roda em threads)
+_loaded = None
+_loaded_lock = threading.Lock()
+
+def _get_model_and_scaler():
+    """Versão memoizada de load_model_and_scaler (só memoiza se carregou)."""
+    global _loaded
+    if _loaded is None:
+        with _loaded_lock:
+            if _loaded is None:
+                model, scaler = load_model_and_scaler()
+                if model is None or scaler is None:
+                    return None, None
+                _loaded = (model, scaler)
+    return _loaded
+
 def calculate_features_for_prediction(ohlc_data):
-    """Calcula features para predição a partir dos dados OHLC"""
+    """
+    Calcula features para predição a partir dos dados OHLC.
+    Aceita lista de dicts (timestamp/open/high/low/close) ou um np.ndarray
+    (n, 5) com colunas [ts, open, high, low, close].
+    """
     if len(ohlc_data) < 60:
         return None
     
     # Extrair preços
-    closes = [candle['close'] for candle in ohlc_data]
-    highs = [candle['high'] for candle in ohlc_data]
-    lows = [candle['low'] for candle in ohlc_data]
+    if isinstance(ohlc_data, np.ndarray):
+        # caminho compilado (features.compute_features)
+        return compute_features(np.asarray(ohlc_data, dtype=np.float64)).reshape(1, -1)
+    else:
+        closes = [candle['close'] for candle in ohlc_data]
+        highs = [candle['high'] for candle in ohlc_data]
+        lows = [candle['low'] for candle in ohlc_data]
     
     # Calcular indicadores
     rsi_values = rsi(closes, 14)
@@ -75,7 +105,7 @@ def calculate_features_for_prediction(ohlc_data):
 
 def predict_signal(symbol, ohlc_data):
     """Faz predição para um símbolo específico"""
-    model, scaler = load_model_and_scaler()
+    model, scaler = _get_model_and_scaler()
     if model is None or scaler is None:
         return None, "Modelo não encontrado"
     
@@ -90,6 +120,9 @@ def predict_signal(symbol, ohlc_data):
     prediction = model.predict(features_scaled)[0]
     probability = model.predict_proba(features_scaled)[0]
     
+    return _build_result(symbol, prediction, probability), None
+
+def _build_result(symbol, prediction, probability):
     confidence = max(probability)
     signal = "COMPRA" if prediction == 1 else "VENDA"
     
@@ -100,7 +133,27 @@ def predict_signal(symbol, ohlc_data):
         'probability_buy': float(probability[1]),
         'probability_sell': float(probability[0]),
         'timestamp': datetime.now().isoformat()
-    }, None
+    }
+
+def predict_signals(symbols, ohlc_arrays):
+    """
+    Predição em lote: features de todos os símbolos num único kernel paralelo
+    e uma chamada de scaler/modelo para a matriz inteira.
+    ohlc_arrays: matrizes (n, 5) float64 com n >= 60. Retorna [(result, error)].
+    """
+    model, scaler = _get_model_and_scaler()
+    if model is None or scaler is None:
+        return [(None, "Modelo não encontrado")] * len(symbols)
+    if not symbols:
+        return []
+    
+    stacked, lengths = stack_ohlc(ohlc_arrays)
+    features_scaled = scaler.transform(batch_compute_features(stacked, lengths))
+    
+    predictions = model.predict(features_scaled)
+    probabilities = model.predict_proba(features_scaled)
+    return [(_build_result(sym, pred, prob), None)
+            for sym, pred, prob in zip(symbols, predictions, probabilities)]
 
 def test_predictions():
     """Testa predições com dados atuais"""
@@ -1,8 +1,11 @@
+import orjson
 import requests
 import pandas as pd
 import time
 import os
 
+from coingecko_client import SYMBOL_TO_ID, session
+
 COINGECKO_API_KEY = os.getenv("COINGECKO_API_KEY", "CG-SnFGo9ozwT62MLbBiuuzpxxh")
 COINGECKO_BASE_URL = "https://api.coingecko.com/api/v3"
 
@@ -11,16 +14,6 @@ HEADERS = {
     "x-cg-demo-api-key": COINGECKO_API_KEY
 }
 
-SYMBOL_TO_ID = {
-    "BTCUSDT": "bitcoin", "ETHUSDT": "ethereum", "BNBUSDT": "binancecoin",
-    "SOLUSDT": "solana", "XRPUSDT": "ripple", "ADAUSDT": "cardano",
-    "AVAXUSDT": "avalanche-2", "DOTUSDT": "polkadot", "LINKUSDT": "chainlink",
-    "TONUSDT": "the-open-network", "INJUSDT": "injective-protocol", "RNDRUSDT": "render-token",
-    "ARBUSDT": "arbitrum", "LTCUSDT": "litecoin", "MATICUSDT": "matic-network",
-    "OPUSDT": "optimism", "NEARUSDT": "near", "APTUSDT": "aptos",
-    "PEPEUSDT": "pepe", "SEIUSDT": "sei-network"
-}
-
 def fetch_historical_data_coingecko(symbol, days=3):
     coin_id = SYMBOL_TO_ID.get(symbol)
     if not coin_id:
@@ -34,9 +27,9 @@ def fetch_historical_data_coingecko(symbol, days=3):
     }
 
     try:
-        response = requests.get(url, params=params, headers=HEADERS)
+        response = session.get(url, params=params, headers=HEADERS)
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
 
         if "prices" not in data or not data["prices"]:
             print(f"⚠️ Dados de preço indisponíveis para {symbol} na resposta da API.")
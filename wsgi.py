@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""
+Entrada WSGI para produção:
+
+    gunicorn -k gthread -w 1 --threads 8 -b 0.0.0.0:$PORT wsgi:app
+
+Um único worker: predições, cache OHLC e cooldown de alertas vivem na memória
+do processo, e cada worker extra rodaria o próprio updater (chamadas dobradas
+ao Coingecko e alertas duplicados no Telegram). A concorrência fica nas threads.
+
+Com REDIS_URL definido dá para usar -w > 1: só o worker que detém o lock
+"pred:updater" roda o ciclo e publica o JSON em "pred:v1"; os demais servem
+/api/predictions direto do Redis.
+"""
+from main import app, start_background
+
+start_background()